@@ -0,0 +1,281 @@
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from mathquiz.instrument import summarize_timings
+from mathquiz.math_helpers import (
+    get_numpy,
+    random_digit,
+    )
+from mathquiz.questions import builtin_question_types
+from mathquiz.results import (
+    QuestionResult,
+    QuizResult,
+    )
+from mathquiz.stats import generate_stats
+from mathquiz.storage import (
+    add_answered_question,
+    configure_storage,
+    get_current_user_data,
+    get_storage,
+    rebuild_user_indexes,
+    )
+from mathquiz.transfer import import_user_results
+
+
+BENCH_SIZES = [1000, 10000, 100000]
+
+BENCH_QUESTIONS = 2000
+
+BENCH_REPEAT = 20
+
+BENCH_SEED = 0
+
+# Questions per synthetic quiz result.
+QUIZ_SIZE = 10
+
+# Commands whose startup is timed, with the modules they mustn't import.
+startup_commands = [
+    (['stats'], [
+        'numpy',
+        'pkg_resources',
+        'BaseHTTPServer',
+        'mathquiz.bench',
+        'mathquiz.quizrunner',
+        'mathquiz.server',
+        'mathquiz.transfer',
+        'mathquiz.worksheet',
+    ]),
+    (['run', '--help'], [
+        'numpy',
+        'pkg_resources',
+        'yaml',
+        'BaseHTTPServer',
+        'mathquiz.questions',
+        'mathquiz.storage',
+        'mathquiz.quizrunner',
+    ]),
+]
+
+# Runs a command and prints the modules it imported, as JSON.
+STARTUP_SCRIPT = """
+import json, os, sys
+out = sys.stdout
+sys.stdout = open(os.devnull, "w")
+from mathquiz.main import main
+try:
+    main(sys.argv)
+except SystemExit:
+    pass
+out.write(json.dumps(sorted(sys.modules)))
+"""
+
+
+def time_calls(func, repeat):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return summarize_timings(timings)
+
+
+def bench_random_digit(n):
+    start = time.time()
+    for _ in xrange(n):
+        random_digit()
+    return {'calls_per_second': n / (time.time() - start)}
+
+
+def bench_generation(n):
+    """Questions generated per second for each type, one at a time and
+    in a batch."""
+    results = {}
+    for question_type in builtin_question_types:
+        start = time.time()
+        for _ in xrange(n):
+            question_type()
+        single = time.time() - start
+
+        start = time.time()
+        question_type.generate_batch(n)
+        batch = time.time() - start
+
+        results[question_type.name] = {
+            'per_second': n / single,
+            'batch_per_second': n / batch,
+        }
+    return results
+
+
+def synthetic_quiz_results(size, rng):
+    """Yield quiz results holding size question results in total."""
+    questions = [
+        question_type()
+        for question_type in builtin_question_types
+        for _ in xrange(50)]
+    timestamp = 1.5e9
+    for start in xrange(0, size, QUIZ_SIZE):
+        question_results = []
+        for _ in xrange(min(QUIZ_SIZE, size - start)):
+            question = rng.choice(questions)
+            question_results.append(QuestionResult(
+                question, str(question.answer), rng.randint(0, 1),
+                timestamp))
+            timestamp += 10
+        yield QuizResult(question_results, timestamp)
+
+
+def bench_history(size, repeat, rng):
+    user = "bench-%d" % size
+    start = time.time()
+    import_user_results(user, synthetic_quiz_results(size, rng))
+    results = {'populate_seconds': time.time() - start}
+
+    questions = [
+        rng.choice(builtin_question_types)() for _ in xrange(repeat)]
+    results['record_answer'] = time_calls(
+        lambda: add_answered_question(
+            user, questions.pop(), "0", rng.randint(0, 1)),
+        repeat)
+    results['stats'] = time_calls(lambda: generate_stats(user), repeat)
+    results['load'] = time_calls(
+        lambda: get_current_user_data(user), min(repeat, 3))
+    results['rebuild_stats'] = time_calls(
+        lambda: rebuild_user_indexes(user), min(repeat, 3))
+    return results
+
+
+def run_benchmarks(sizes=BENCH_SIZES, questions=BENCH_QUESTIONS,
+                   repeat=BENCH_REPEAT, seed=BENCH_SEED):
+    """Run every benchmark against a scratch storage directory."""
+    random.seed(seed)
+    rng = random.Random(seed)
+    storage_name = get_storage().name
+    results = {
+        'python': platform.python_version(),
+        'numpy': get_numpy() is not None,
+        'storage': storage_name,
+        'seed': seed,
+        'time': time.time(),
+        'random_digit': bench_random_digit(questions * 10),
+        'generation': bench_generation(questions),
+        'history': {},
+    }
+
+    home = os.environ.get('HOME')
+    scratch_dir = tempfile.mkdtemp(prefix="mathquiz-bench-")
+    os.environ['HOME'] = scratch_dir
+    try:
+        configure_storage(storage_name)
+        for size in sizes:
+            results['history'][str(size)] = bench_history(size, repeat, rng)
+    finally:
+        if home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = home
+        configure_storage(storage_name)
+        shutil.rmtree(scratch_dir)
+
+    return results
+
+
+def run_startup_command(command, env):
+    start = time.time()
+    output = subprocess.check_output(
+        [sys.executable, '-c', STARTUP_SCRIPT] + command, env=env)
+    return time.time() - start, json.loads(output)
+
+
+def bench_startup(repeat=BENCH_REPEAT):
+    """Time the startup of the commands in startup_commands, and list any
+    modules they imported that they shouldn't have."""
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    scratch_dir = tempfile.mkdtemp(prefix="mathquiz-bench-")
+    env = dict(os.environ, HOME=scratch_dir, PYTHONPATH=package_dir)
+    results = {}
+    try:
+        for command, forbidden in startup_commands:
+            # The first run fills the caches the others start from.
+            _, modules = run_startup_command(command, env)
+            timings = []
+            for _ in xrange(repeat):
+                seconds, modules = run_startup_command(command, env)
+                timings.append(seconds)
+            results[" ".join(command)] = dict(
+                summarize_timings(timings),
+                forbidden_imports=sorted(set(forbidden) & set(modules)))
+    finally:
+        shutil.rmtree(scratch_dir)
+    return results
+
+
+def check_startup(results, max_ms=None):
+    """Return a description of each way startup regressed."""
+    errors = []
+    for command, command_results in sorted(results.iteritems()):
+        if command_results['forbidden_imports']:
+            errors.append("%s imports %s" % (
+                command, ", ".join(command_results['forbidden_imports'])))
+        if max_ms is not None and command_results['p50_ms'] > max_ms:
+            errors.append("%s takes %dms, more than %dms" % (
+                command, command_results['p50_ms'], max_ms))
+    return errors
+
+
+def write_results(args, results):
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output == "-":
+        sys.stdout.write(output + "\n")
+    else:
+        with open(args.output, "w") as out_file:
+            out_file.write(output + "\n")
+
+
+def bench(args):
+    if args.startup:
+        results = bench_startup(args.repeat)
+        write_results(args, results)
+        errors = check_startup(results, args.max_startup_ms)
+        if errors:
+            sys.exit("\n".join(errors))
+        return
+
+    results = run_benchmarks(
+        args.sizes, args.questions, args.repeat, args.seed)
+    write_results(args, results)
+
+
+def setup_parser(parser):
+    parser.help = "Benchmark question generation, storage and stats."
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=BENCH_SIZES,
+        help="Numbers of results in the synthetic histories.")
+    parser.add_argument(
+        "--questions", type=int, default=BENCH_QUESTIONS,
+        help="Questions of each type to generate.")
+    parser.add_argument(
+        "--repeat", type=int, default=BENCH_REPEAT,
+        help="Times to repeat each timed storage operation.")
+    parser.add_argument(
+        "--seed", type=int, default=BENCH_SEED,
+        help="Random seed, so runs can be compared.")
+    parser.add_argument(
+        "--startup", action="store_true",
+        help="Only time command startup, failing if a command imports "
+             "modules it doesn't need.")
+    parser.add_argument(
+        "--max-startup-ms", type=int,
+        help="With --startup, also fail if a command's median startup "
+             "time is longer than this.")
+    parser.add_argument(
+        "-o", "--output", default="-",
+        help="File to write JSON results to. By default, standard output.")
+    parser.set_defaults(func=bench)
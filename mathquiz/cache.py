@@ -0,0 +1,218 @@
+import copy
+import threading
+import time
+
+from collections import OrderedDict
+
+from mathquiz.storage import Storage
+
+
+# Write a user's changes back once this many are waiting...
+CACHE_FLUSH_THRESHOLD = 50
+
+# ...or once the oldest has waited this many seconds.
+CACHE_FLUSH_INTERVAL = 5.0
+
+# Evict the least recently used users once the cache holds more results
+# and unanswered questions than this.
+CACHE_MAX_ITEMS = 100000
+
+
+def count_items(user_data):
+    return len(user_data['results']) + len(user_data['unanswered_questions'])
+
+
+class CacheEntry(object):
+    def __init__(self):
+        self.user_data = None
+        self.records = {}
+        self.dirty_records = set()
+        # Changes not yet written to the backend, oldest first.
+        self.pending = []
+        self.pending_since = None
+
+    @property
+    def dirty(self):
+        return bool(self.pending or self.dirty_records)
+
+    @property
+    def size(self):
+        size = len(self.pending)
+        if self.user_data is not None:
+            size += count_items(self.user_data)
+        return size
+
+
+class CachedStorage(Storage):
+    """Keeps recently used users' data in memory in front of a backend.
+
+    Reads are answered from memory once a user has been loaded. Changes
+    are applied in memory straight away and written back to the backend
+    in batches, when enough have built up or the oldest has waited
+    flush_interval seconds, when the user is evicted and on close.
+
+    The cache assumes it's the only writer of the users it holds, so it
+    shouldn't be used when other processes update the same users.
+    """
+
+    def __init__(self, backend, flush_threshold=CACHE_FLUSH_THRESHOLD,
+                 flush_interval=CACHE_FLUSH_INTERVAL,
+                 max_items=CACHE_MAX_ITEMS):
+        self.backend = backend
+        self.name = backend.name
+        self.flush_threshold = flush_threshold
+        self.flush_interval = flush_interval
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.mutex = threading.RLock()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush(expired_only=True)
+
+    def get_entry(self, user):
+        entry = self.entries.pop(user, None)
+        if entry is None:
+            entry = CacheEntry()
+        self.entries[user] = entry
+        return entry
+
+    def get_user_data(self, user):
+        entry = self.get_entry(user)
+        if entry.user_data is None:
+            if entry.pending and entry.pending[0][0] == 'write':
+                user_data = None
+            else:
+                user_data = self.backend.load(user)
+            for change in entry.pending:
+                user_data = apply_change(user_data, change)
+            entry.user_data = user_data
+            self.evict()
+        return entry.user_data
+
+    def add_change(self, user, change):
+        entry = self.get_entry(user)
+        if change[0] == 'write':
+            entry.pending = []
+        entry.pending.append(change)
+        if entry.user_data is not None:
+            entry.user_data = apply_change(entry.user_data, change)
+        self.changed(user, entry)
+
+    def changed(self, user, entry):
+        if entry.pending_since is None:
+            entry.pending_since = time.time()
+        if len(entry.pending) >= self.flush_threshold:
+            self.flush_user(user, entry)
+        self.evict()
+
+    def lock(self, user):
+        # Everything in the cache is already serialized by the mutex, and
+        # taking the backend's lock here could deadlock with a flush.
+        return self.mutex
+
+    def load(self, user):
+        with self.mutex:
+            return self.get_user_data(user)
+
+    def write(self, user, user_data):
+        with self.mutex:
+            self.add_change(user, ('write', user_data))
+
+    def append(self, user, list_name, item):
+        with self.mutex:
+            self.add_change(user, ('append', list_name, item))
+
+    # Unanswered questions are kept by the backend, in the same place
+    # whether the cache is used or not.
+    def add_unanswered(self, user, question):
+        self.backend.add_unanswered(user, question)
+
+    def get_unanswered(self, user, question_uuid=None):
+        return self.backend.get_unanswered(user, question_uuid)
+
+    def remove_unanswered(self, user, question_uuid):
+        return self.backend.remove_unanswered(user, question_uuid)
+
+    def load_record(self, user, name):
+        with self.mutex:
+            entry = self.get_entry(user)
+            if name not in entry.records:
+                entry.records[name] = self.backend.load_record(user, name)
+            # Callers update the records they load in place, which mustn't
+            # change the cached copy behind write_record's back.
+            return copy.deepcopy(entry.records[name])
+
+    def write_record(self, user, name, record):
+        with self.mutex:
+            entry = self.get_entry(user)
+            entry.records[name] = copy.deepcopy(record)
+            entry.dirty_records.add(name)
+            self.changed(user, entry)
+
+    def iter_results(self, user):
+        with self.mutex:
+            entry = self.get_entry(user)
+            if entry.user_data is not None:
+                return iter(list(entry.user_data['results']))
+            self.flush_user(user, entry)
+        return self.backend.iter_results(user)
+
+    def list_users(self):
+        self.flush()
+        return self.backend.list_users()
+
+    def flush_user(self, user, entry):
+        if entry.user_data is not None and len(entry.pending) > 1 and \
+                not self.backend.incremental_writes:
+            # One rewrite is cheaper than rewriting once per change.
+            self.backend.write(user, entry.user_data)
+        else:
+            for change in entry.pending:
+                if change[0] == 'write':
+                    self.backend.write(user, change[1])
+                else:
+                    self.backend.append(user, change[1], change[2])
+        entry.pending = []
+
+        for name in sorted(entry.dirty_records):
+            self.backend.write_record(user, name, entry.records[name])
+        entry.dirty_records.clear()
+        entry.pending_since = None
+
+    def flush(self, expired_only=False):
+        """Write every user's pending changes to the backend."""
+        with self.mutex:
+            now = time.time()
+            for user, entry in self.entries.items():
+                if not entry.dirty:
+                    continue
+                if expired_only and \
+                        now - entry.pending_since < self.flush_interval:
+                    continue
+                self.flush_user(user, entry)
+
+    def evict(self):
+        total_items = sum(entry.size for entry in self.entries.itervalues())
+        while total_items > self.max_items and len(self.entries) > 1:
+            user, entry = self.entries.popitem(last=False)
+            total_items -= entry.size
+            if entry.dirty:
+                self.flush_user(user, entry)
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+
+
+def apply_change(user_data, change):
+    """Apply a pending change to user_data and return the result."""
+    if change[0] == 'write':
+        return change[1]
+    user_data[change[1]].append(change[2])
+    return user_data
@@ -0,0 +1,17 @@
+import os
+
+
+LOCAL_STORAGE_PATH = ".mathquiz"
+
+DEFAULT_STORAGE_BACKEND = "journal"
+
+storage_backends = {
+    'yaml': 'mathquiz.storage.YamlStorage',
+    'journal': 'mathquiz.journal.JournalStorage',
+    'sqlite': 'mathquiz.sqlite_storage.SqliteStorage',
+}
+
+
+def get_local_storage_dir():
+    home_path = os.getenv("HOME")
+    return os.path.join(home_path, LOCAL_STORAGE_PATH)
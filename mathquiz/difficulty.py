@@ -0,0 +1,93 @@
+import math
+
+from mathquiz.questions import get_question_type
+
+
+# How much a single answer can move a rating, in difficulty levels.
+LEARNING_RATE = 0.4
+
+# Generate questions the user should answer correctly this often.
+TARGET_SUCCESS_RATE = 0.75
+
+
+def expected_success(rating, level):
+    return 1.0 / (1.0 + math.exp(level - rating))
+
+
+class DifficultyRatings(object):
+    """A user's skill along each difficulty dimension of each question type.
+
+    A rating is the level along a dimension at which the user is
+    expected to answer correctly half of the time. After each answer the
+    rating of every dimension of the question moves, Elo style, by how
+    surprising the outcome was given the question's level along that
+    dimension.
+    """
+
+    name = "difficulty"
+
+    def __init__(self, ratings=None):
+        if ratings is None:
+            self.ratings = {}
+        else:
+            self.ratings = ratings
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record['ratings'])
+
+    def to_record(self):
+        return {'ratings': self.ratings}
+
+    @classmethod
+    def from_user_data(cls, user_data):
+        ratings = cls()
+        for quiz_result in user_data['results']:
+            ratings.record_quiz_result(quiz_result)
+        return ratings
+
+    def rating(self, question_type, dimension):
+        type_ratings = self.ratings.get(question_type.name, {})
+        if dimension in type_ratings:
+            return type_ratings[dimension]
+
+        lowest, highest = question_type.difficulty_dimensions[dimension]
+        return (lowest + highest) / 2.0
+
+    def record(self, question_type, difficulty, result):
+        if question_type.name not in self.ratings:
+            self.ratings[question_type.name] = {}
+
+        for dimension, level in difficulty.iteritems():
+            rating = self.rating(question_type, dimension)
+            surprise = result - expected_success(rating, level)
+            self.ratings[question_type.name][dimension] = \
+                rating + LEARNING_RATE * surprise
+
+    def record_result(self, question_result):
+        try:
+            question_type = get_question_type(question_result.question_name)
+        except KeyError:
+            return
+        if not question_type.difficulty_dimensions:
+            return
+        question = question_result.question
+        if question is None:
+            return
+
+        self.record(
+            question_type, question.difficulty(), question_result.result)
+
+    def record_quiz_result(self, quiz_result):
+        for question_result in quiz_result.results:
+            self.record_result(question_result)
+
+    def target_difficulty(self, question_type):
+        """Return the level along each dimension to aim new questions at."""
+        offset = math.log(TARGET_SUCCESS_RATE / (1 - TARGET_SUCCESS_RATE))
+        target = {}
+        for dimension, (lowest, highest) in \
+                question_type.difficulty_dimensions.iteritems():
+            level = int(round(self.rating(question_type, dimension) - offset))
+            target[dimension] = max(lowest, min(highest, level))
+        return target
@@ -0,0 +1,128 @@
+import functools
+import threading
+import time
+
+from collections import deque
+
+
+# Durations kept per span for percentiles.
+SPAN_WINDOW = 10000
+
+_enabled = False
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def summarize_timings(timings):
+    """Return the mean, median, 95th percentile and max in milliseconds."""
+    ordered = sorted(timings)
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[int(len(ordered) * 0.95)] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def record(name, seconds):
+    with _lock:
+        if name not in _spans:
+            _spans[name] = {
+                'count': 0,
+                'total': 0.0,
+                'timings': deque(maxlen=SPAN_WINDOW),
+            }
+        span_stats = _spans[name]
+        span_stats['count'] += 1
+        span_stats['total'] += seconds
+        span_stats['timings'].append(seconds)
+
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class Span(object):
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.time() - self.start)
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_span = NullSpan()
+
+
+def span(name):
+    """Return a context manager timing its body as the named span."""
+    if not _enabled:
+        return _null_span
+    return Span(name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as the named span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.time() - start)
+        return wrapper
+    return decorator
+
+
+def summary():
+    """Return the timings of every span and the value of every counter.
+
+    Span counts and totals cover every call, percentiles only the last
+    SPAN_WINDOW."""
+    with _lock:
+        spans = {}
+        for name, span_stats in _spans.iteritems():
+            spans[name] = summarize_timings(span_stats['timings'])
+            spans[name]['count'] = span_stats['count']
+            spans[name]['total_ms'] = span_stats['total'] * 1000
+        return {'spans': spans, 'counters': dict(_counters)}
@@ -0,0 +1,238 @@
+import os
+import sys
+import threading
+import yaml
+
+from mathquiz import serialization
+from mathquiz.locking import atomic_write
+from mathquiz.storage import (
+    YamlStorage,
+    get_default_user_data,
+    get_local_storage_dir,
+    get_user_yaml_path,
+    init_local_storage,
+    )
+
+
+_journal_logs = {}
+_journal_logs_lock = threading.Lock()
+
+
+def get_user_journal_path(user):
+    local_storage_dir = get_local_storage_dir()
+    return os.path.join(local_storage_dir, "%s.journal" % user)
+
+
+def iter_journal_records(journal_file):
+    """Yield the records of a journal, skipping any that can't be read.
+
+    A last line without a newline is a torn write from a crash. Such a
+    line is cut off before the next append, but a reader can still see
+    it in the meantime."""
+    for line_number, line in enumerate(journal_file, 1):
+        if not line.endswith("\n"):
+            break
+        try:
+            record = serialization.load(line)
+        except yaml.YAMLError:
+            record = None
+        if not isinstance(record, dict) or 'op' not in record:
+            sys.stderr.write("Skipping unreadable line %d of %s\n" % (
+                line_number, journal_file.name))
+            continue
+        yield record
+
+
+def trim_torn_line(journal_file):
+    """Cut a torn last line off a journal opened for update."""
+    journal_file.seek(0, os.SEEK_END)
+    end = journal_file.tell()
+    position = end
+    while position > 0:
+        block_size = min(4096, position)
+        journal_file.seek(position - block_size)
+        block = journal_file.read(block_size)
+        newline = block.rfind("\n")
+        if newline != -1:
+            position = position - block_size + newline + 1
+            break
+        position -= block_size
+    if position != end:
+        journal_file.truncate(position)
+
+
+def apply_record(user_data, record):
+    """Apply a journal record to user_data."""
+    list_name = record['list']
+    if record['op'] == 'add':
+        user_data[list_name].append(record['item'])
+    elif record['op'] == 'remove':
+        # Only found in journals written while unanswered questions were
+        # kept in them.
+        for index, item in enumerate(user_data[list_name]):
+            if item.uuid == record['uuid']:
+                del user_data[list_name][index]
+                break
+    else:
+        raise ValueError("Bad journal record: %s" % record['op'])
+
+
+class JournalLog(object):
+    """Group commit for appends to a journal.
+
+    Writers queue their lines and then take the user's lock. Whoever
+    gets the lock writes and syncs every line queued so far in one go,
+    so writers that queued while it was busy usually find their lines
+    already committed when they get the lock in turn.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mutex = threading.Lock()
+        self.pending = []
+        self.queued = 0
+        self.committed = 0
+
+    def add(self, line):
+        """Queue line and return its sequence number."""
+        with self.mutex:
+            self.pending.append(line)
+            self.queued += 1
+            return self.queued
+
+    def commit(self, sequence):
+        """Make sure the line with the given sequence number is written.
+
+        Must be called with the user's lock held."""
+        with self.mutex:
+            if self.committed >= sequence:
+                return
+            lines = self.pending
+            self.pending = []
+            last_sequence = self.queued
+
+        try:
+            with open(self.path, "a+") as journal_file:
+                # Appending after a torn line would spoil the new one too.
+                trim_torn_line(journal_file)
+                journal_file.write("".join(lines))
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+        except (IOError, OSError):
+            with self.mutex:
+                self.pending[:0] = lines
+            raise
+
+        with self.mutex:
+            self.committed = last_sequence
+
+
+def get_journal_log(path):
+    with _journal_logs_lock:
+        if path not in _journal_logs:
+            _journal_logs[path] = JournalLog(path)
+        return _journal_logs[path]
+
+
+class JournalStorage(YamlStorage):
+    """Stores a user's data as an append-only journal, one record per line.
+
+    Recording a result appends a single line, and state is rebuilt by
+    replaying the journal. An existing YAML file is migrated into a
+    journal the first time the user is accessed.
+
+    Appends, rewrites and migration hold the user's lock. Readers don't
+    need it, since rewrites replace the journal atomically and a partly
+    written last line is ignored. The next append cuts such a
+    line off, and lines that can't be read are skipped.
+    """
+
+    name = "journal"
+    incremental_writes = True
+
+    def load(self, user):
+        journal_path = get_user_journal_path(user)
+        if not os.path.exists(journal_path):
+            return self.migrate(user)
+        return self.replay(journal_path)
+
+    def replay(self, journal_path):
+        """Rebuild user data from a journal."""
+        user_data = get_default_user_data()
+        with open(journal_path, "r") as journal_file:
+            for record in iter_journal_records(journal_file):
+                apply_record(user_data, record)
+        return user_data
+
+    def iter_results(self, user):
+        """Yield a user's quiz results, reading one line at a time.
+
+        Results are never removed, so every result in the journal is
+        still current."""
+        journal_path = get_user_journal_path(user)
+        if not os.path.exists(journal_path):
+            for quiz_result in self.migrate(user)['results']:
+                yield quiz_result
+            return
+
+        with open(journal_path, "r") as journal_file:
+            for record in iter_journal_records(journal_file):
+                if record['op'] == 'add' and record['list'] == 'results':
+                    yield record['item']
+
+    def list_users(self):
+        # Users whose YAML file hasn't been migrated yet count too.
+        users = set(super(JournalStorage, self).list_users())
+        local_storage_dir = get_local_storage_dir()
+        if os.path.isdir(local_storage_dir):
+            users.update(
+                file_name[:-len(".journal")]
+                for file_name in os.listdir(local_storage_dir)
+                if file_name.endswith(".journal"))
+        return sorted(users)
+
+    def migrate(self, user):
+        user_yaml_path = get_user_yaml_path(user)
+        if not os.path.exists(user_yaml_path):
+            return get_default_user_data()
+
+        with self.lock(user):
+            journal_path = get_user_journal_path(user)
+            if os.path.exists(journal_path):
+                # Another process migrated it first.
+                return self.replay(journal_path)
+
+            user_data = super(JournalStorage, self).load(user)
+            self.write(user, user_data)
+            os.rename(user_yaml_path, "%s.migrated" % user_yaml_path)
+            return user_data
+
+    def write(self, user, user_data):
+        init_local_storage(user)
+        with self.lock(user):
+            atomic_write(get_user_journal_path(user), (
+                serialization.dump_line({
+                    'op': 'add',
+                    'list': list_name,
+                    'item': item,
+                })
+                for list_name in ('results', 'unanswered_questions')
+                for item in user_data[list_name]))
+
+    def append(self, user, list_name, item):
+        self.extend(user, list_name, [item])
+
+    def extend(self, user, list_name, items):
+        journal_path = get_user_journal_path(user)
+        journal_log = get_journal_log(journal_path)
+        sequence = 0
+        for item in items:
+            sequence = journal_log.add(serialization.dump_line({
+                'op': 'add',
+                'list': list_name,
+                'item': item,
+            }))
+        with self.lock(user):
+            if not os.path.exists(journal_path):
+                self.migrate(user)
+            journal_log.commit(sequence)
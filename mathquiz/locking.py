@@ -0,0 +1,95 @@
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+DEFAULT_FILE_MODE = 0o644
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class FileLock(object):
+    """An exclusive lock held across threads and processes.
+
+    Threads in this process are serialized by an RLock, and the first
+    acquisition by a thread takes an flock on the lock file to exclude
+    other processes. The lock is reentrant, so a thread holding it can
+    call code that takes it again. Without fcntl only threads are
+    excluded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+
+    def acquire(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.lock_file = open(self.path, "a")
+                if fcntl is not None:
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            except (IOError, OSError):
+                if self.lock_file is not None:
+                    self.lock_file.close()
+                    self.lock_file = None
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            # Closing the file drops the flock.
+            self.lock_file.close()
+            self.lock_file = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def get_file_lock(path):
+    """Return the lock for path, shared by every caller in this process."""
+    with _locks_lock:
+        if path not in _locks:
+            _locks[path] = FileLock(path)
+        return _locks[path]
+
+
+def atomic_write(path, chunks):
+    """Replace the file at path with the strings in chunks.
+
+    They're written to a temporary file that is synced and renamed over
+    path, so readers see either the old file or the new one, never a
+    partial write.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        prefix="%s." % os.path.basename(path), suffix=".tmp",
+        dir=os.path.dirname(path))
+    try:
+        # mkstemp makes files only their owner can read.
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        else:
+            os.chmod(tmp_path, DEFAULT_FILE_MODE)
+        with os.fdopen(fd, "w") as tmp_file:
+            tmp_file.writelines(chunks)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
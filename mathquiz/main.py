@@ -1,7 +1,50 @@
+import importlib
+import json
+import os
+import sys
+
 from argparse import ArgumentParser
-from mathquiz.questions import builtin_question_types
-from mathquiz.quizrunner import ConsoleQuizRunner
-from mathquiz.stats import setup_parser as setup_stats_parser
+from mathquiz import instrument
+from mathquiz.config import (
+    DEFAULT_STORAGE_BACKEND,
+    storage_backends,
+    )
+
+
+# (name, parser setup function, help). Only the setup function of the
+# subcommand being run is imported, so each one pays for its own imports.
+subcommands = [
+    ('run', 'mathquiz.registry.setup_run_parser', "Enjoy a math quiz."),
+    ('stats', 'mathquiz.stats.setup_parser', "Show quiz statistics."),
+    ('serve', 'mathquiz.server.setup_parser', "Serve quizzes over HTTP."),
+    ('export', 'mathquiz.transfer.setup_export_parser',
+     "Export quiz results as JSON lines or CSV."),
+    ('import', 'mathquiz.transfer.setup_import_parser',
+     "Import quiz results from JSON lines or CSV."),
+    ('generate', 'mathquiz.worksheet.setup_parser',
+     "Generate worksheets with answer keys."),
+    ('bench', 'mathquiz.bench.setup_parser',
+     "Benchmark question generation, storage and stats."),
+]
+
+# Global options followed by a value.
+global_value_options = ['-u', '--user', '-s', '--storage']
+
+
+def import_name(dotted_name):
+    module_name, name = dotted_name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), name)
+
+
+def find_subcommand(args):
+    """Return the name of the subcommand in the arguments, if any."""
+    args = iter(args)
+    for arg in args:
+        if arg in global_value_options:
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
 
 
 def get_args(argv):
@@ -9,17 +52,45 @@ def get_args(argv):
     parser.add_argument(
         "-u", "--user",
         default="default", help="Name of user.")
+    parser.add_argument(
+        "-s", "--storage",
+        default=os.getenv("MATHQUIZ_STORAGE", DEFAULT_STORAGE_BACKEND),
+        choices=sorted(storage_backends.keys()),
+        help="Storage backend for user data.")
+    parser.add_argument(
+        "--profile", action="store_true",
+        default=bool(os.getenv("MATHQUIZ_PROFILE")),
+        help="Time the hot paths and print a JSON summary at exit.")
+    parser.add_argument(
+        "-c", "--cache", action="store_true",
+        default=bool(os.getenv("MATHQUIZ_CACHE")),
+        help="Keep user data in memory and write it back in batches.")
     subparsers = parser.add_subparsers()
-    runner = ConsoleQuizRunner(builtin_question_types)
-    runner.setup_parser(subparsers.add_parser('run'))
-    setup_stats_parser(subparsers.add_parser('stats'))
+    subcommand = find_subcommand(argv[1:])
+    for name, setup_function, help_text in subcommands:
+        subparser = subparsers.add_parser(name, help=help_text)
+        if name == subcommand:
+            import_name(setup_function)(subparser)
     args = parser.parse_args(argv[1:])
+    if isinstance(args.func, str):
+        args.func = import_name(args.func)
     return args
 
 
 def run_quiz(argv):
     args = get_args(argv)
-    args.func(args)
+    import_name('mathquiz.storage.configure_storage')(
+        args.storage, args.cache)
+    if not args.profile:
+        args.func(args)
+        return
+
+    instrument.enable()
+    try:
+        args.func(args)
+    finally:
+        sys.stderr.write("%s\n" % json.dumps(
+            instrument.summary(), indent=2, sort_keys=True))
 
 
 def main(argv):
@@ -0,0 +1,86 @@
+MASTERY_SIZE = 30
+MASTERY_PERCENT = 0.90
+
+
+class MasteryIndex(object):
+    """Results of the most recent questions of each question type.
+
+    Keeps a window of the last MASTERY_SIZE results per type along with
+    a running count of the correct ones, so mastery can be checked
+    without looking at the rest of the user's history.
+    """
+
+    name = "mastery"
+
+    def __init__(self, windows=None):
+        if windows is None:
+            self.windows = {}
+        else:
+            self.windows = windows
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record['windows'])
+
+    def to_record(self):
+        return {'windows': self.windows}
+
+    @classmethod
+    def from_user_data(cls, user_data):
+        mastery_index = cls()
+        for quiz_result in user_data['results']:
+            mastery_index.record_quiz_result(quiz_result)
+        return mastery_index
+
+    def record(self, question_type_name, result):
+        if question_type_name not in self.windows:
+            self.windows[question_type_name] = {'results': [], 'correct': 0}
+
+        window = self.windows[question_type_name]
+        window['results'].append(result)
+        window['correct'] += result
+        if len(window['results']) > MASTERY_SIZE:
+            window['correct'] -= window['results'].pop(0)
+
+    def record_quiz_result(self, quiz_result):
+        for question_result in quiz_result.results:
+            self.record(question_result.question_name, question_result.result)
+
+    def recent_results(self, question_type_name):
+        if question_type_name not in self.windows:
+            return []
+        return self.windows[question_type_name]['results']
+
+    def correct(self, question_type_name):
+        if question_type_name not in self.windows:
+            return 0
+        return self.windows[question_type_name]['correct']
+
+    def total(self, question_type_name):
+        return len(self.recent_results(question_type_name))
+
+    def is_mastered(self, question_type_name):
+        if self.total(question_type_name) < MASTERY_SIZE:
+            return False
+
+        return (self.correct(question_type_name) / float(MASTERY_SIZE) >=
+                MASTERY_PERCENT)
+
+    def group_by_mastery(self, question_types):
+        """Partition a set of question types by mastery.
+
+        Mastery is defined as having answered at least 30 questions of the
+        type with at least 90% success rate over the last 30 questions.
+        """
+        mastered_question_types = set()
+        unmastered_question_types = set()
+        for question_type in question_types:
+            if self.is_mastered(question_type.name):
+                mastered_question_types.add(question_type)
+            else:
+                unmastered_question_types.add(question_type)
+
+        return {
+            'mastered': mastered_question_types,
+            'unmastered': unmastered_question_types,
+            }
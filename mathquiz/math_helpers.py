@@ -1,62 +1,335 @@
-import math
+import bisect
+import importlib
 import random
+import threading
 
+from collections import OrderedDict
 from fractions import Fraction
 
 
-def random_digit(min_val=0, max_val=100000):
+SAMPLER_CACHE_SIZE = 256
+
+# numpy is imported the first time it's needed, since importing it
+# takes longer than the rest of start up.
+_numpy = False
+
+MASK64 = 2**64 - 1
+POWERS_OF_TEN = [10**exponent for exponent in range(19)]
+
+
+def get_numpy():
+    """Return the numpy module, or None if it isn't installed."""
+    global _numpy
+    if _numpy is False:
+        try:
+            _numpy = importlib.import_module('numpy')
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+
+def ceil_log10(value):
+    """Return ceil(log10(value)), or 0 for 0, without rounding errors."""
+    return bisect.bisect_left(POWERS_OF_TEN, value)
+
+
+def seeded_uniform(seed, index):
+    """Return the index'th number in [0, 1) of the stream for a seed.
+
+    It's the splitmix64 hash of the seed and index, so any draw can be
+    computed on its own, and for many seeds at once by seeded_uniforms.
+    """
+    z = ((seed << 32) + index + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    z ^= z >> 31
+    return (z >> 11) * 2.0**-53
+
+
+def seeded_uniforms(seeds, indexes):
+    """seeded_uniform for numpy arrays of seeds and indexes."""
+    numpy = get_numpy()
+    uint64 = numpy.uint64
+    z = (seeds << uint64(32)) + indexes + uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> uint64(30))) * uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> uint64(27))) * uint64(0x94D049BB133111EB)
+    z ^= z >> uint64(31)
+    return (z >> uint64(11)).astype(numpy.float64) * 2.0**-53
+
+
+class SeededRandom(random.Random):
+    """A generator drawing from the seeded_uniform stream of a seed.
+
+    Unlike random.Random, the same draws can be made for a whole batch
+    of seeds at once with SeededRandomBatch."""
+
+    def seed(self, a=None):
+        if a is None:
+            a = random.getrandbits(32)
+        self.stream_seed = a
+        self.draws = 0
+
+    def random(self):
+        value = seeded_uniform(self.stream_seed, self.draws)
+        self.draws += 1
+        return value
+
+    def getrandbits(self, k):
+        bits = 0
+        for _ in range(0, k, 32):
+            bits = (bits << 32) | int(self.random() * 2**32)
+        return bits >> (-k % 32)
+
+    def getstate(self):
+        return self.stream_seed, self.draws
+
+    def setstate(self, state):
+        self.stream_seed, self.draws = state
+
+
+class SeededRandomBatch(object):
+    """Makes the draws of a SeededRandom for each of a list of seeds.
+
+    Each call returns a numpy array with the next draw of every seed.
+    Rows left out by where don't use up a draw, like a SeededRandom that
+    isn't called."""
+
+    def __init__(self, seeds):
+        numpy = get_numpy()
+        self.seeds = numpy.asarray(seeds, dtype=numpy.uint64)
+        self.draws = numpy.zeros(len(self.seeds), dtype=numpy.uint64)
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def random(self, where=None):
+        values = seeded_uniforms(self.seeds, self.draws)
+        if where is None:
+            self.draws += 1
+        else:
+            self.draws += where
+        return values
+
+    def randbelow(self, n, where=None):
+        """Draw integers in [0, n) like SeededRandom.choice picks an
+        index."""
+        numpy = get_numpy()
+        return numpy.floor(self.random(where) * n).astype(numpy.int64)
+
+
+class LRUCache(object):
+    """A mapping that holds at most maxsize items, dropping the least
+    recently used item when full. Safe to share between threads."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class AliasTable(object):
+    """Samples indexes in proportion to a list of weights in constant time.
+
+    Built with Vose's alias method."""
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = float(sum(weights))
+        scaled = [weight * count / total for weight in weights]
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def sample(self, rng=random):
+        index = int(rng.random() * len(self.probabilities))
+        if rng.random() < self.probabilities[index]:
+            return index
+        return self.aliases[index]
+
+
+class DigitSampler(object):
+    """Draws random digits between min_val and max_val.
+
+    log10(val) is uniformly distributed between ceil(log10(min_val)) and
+    ceil(log10(max_val)), except that 0 is picked as an exponent a tenth
+    as often as the others. The exponent distribution is worked out once
+    so each sample is constant time."""
+
+    def __init__(self, min_val=0, max_val=100000):
+        if max_val < min_val:
+            raise ValueError(
+                "max (%d) is less than min (%d)" % (max_val, min_val))
+
+        if min_val < 0:
+            raise ValueError(
+                "negative values not supported.")
+
+        self.min_val = min_val
+        self.max_val = max_val
+
+        min_exp = ceil_log10(min_val)
+        max_exp = ceil_log10(max_val)
+
+        self.ranges = []
+        for base in range(min_exp, max_exp + 1):
+            if base > 0:
+                min_int = max(min_val, 10**(base-1))
+            else:
+                min_int = min_val
+            self.ranges.append((min_int, min(10**base, max_val)))
+
+        self.exponents = get_exponent_table(min_exp, len(self.ranges))
+
+    def sample(self, rng=random):
+        if self.min_val == self.max_val:
+            return self.min_val
+
+        min_int, max_int = self.ranges[self.exponents.sample(rng)]
+        return min_int + int(rng.random() * (max_int - min_int + 1))
+
+
+def get_exponent_table(first_exp, count):
+    """Return the AliasTable a DigitSampler picks exponents with.
+
+    It only depends on whether the exponents start at 0 and how many
+    there are."""
+    key = (first_exp == 0, count)
+    table = _exponent_tables.get(key)
+    if table is None:
+        weights = [1 if first_exp == 0 and index == 0 else 10
+                   for index in range(count)]
+        table = AliasTable(weights)
+        _exponent_tables.put(key, table)
+    return table
+
+
+class FractionSampler(object):
+    """Draws random fractions with numerator and denominator up to
+    max_val."""
+
+    def __init__(self, max_val=12):
+        self.numerators = get_digit_sampler(0, max_val)
+        self.denominators = get_digit_sampler(1, max_val)
+
+    def sample(self, rng=random):
+        return Fraction(
+            self.numerators.sample(rng), self.denominators.sample(rng))
+
+
+_exponent_tables = LRUCache(SAMPLER_CACHE_SIZE)
+_digit_samplers = LRUCache(SAMPLER_CACHE_SIZE)
+_fraction_samplers = LRUCache(SAMPLER_CACHE_SIZE)
+
+
+def get_digit_sampler(min_val=0, max_val=100000):
+    key = (min_val, max_val)
+    sampler = _digit_samplers.get(key)
+    if sampler is None:
+        sampler = DigitSampler(min_val, max_val)
+        _digit_samplers.put(key, sampler)
+    return sampler
+
+
+def get_fraction_sampler(max_val=12):
+    sampler = _fraction_samplers.get(max_val)
+    if sampler is None:
+        sampler = FractionSampler(max_val)
+        _fraction_samplers.put(max_val, sampler)
+    return sampler
+
+
+def random_digit(min_val=0, max_val=100000, rng=random):
     """Returns a random digit less than max_val.
 
     log10(val) should be uniformly distributed between 0 and
     ceil(log10(max_val))."""
 
-    if max_val < min_val:
-        raise ValueError(
-            "max (%d) is less than min (%d)" % (max_val, min_val))
+    return get_digit_sampler(min_val, max_val).sample(rng)
 
-    if min_val < 0:
-        raise ValueError(
-            "negative values not supported.")
 
-    if min_val == max_val:
-        return min_val
+def random_digits(rng, min_val=0, max_val=100000):
+    """Draw a random digit for each seed of a SeededRandomBatch.
 
-    if max_val == 0:
-        return 0
+    Returns a numpy array holding what random_digit would give with a
+    SeededRandom for each seed. min_val and max_val may be numbers or
+    arrays with a bound for each seed."""
+    numpy = get_numpy()
+    size = len(rng)
+    min_vals = numpy.broadcast_to(
+        numpy.asarray(min_val, dtype=numpy.int64), (size,))
+    max_vals = numpy.broadcast_to(
+        numpy.asarray(max_val, dtype=numpy.int64), (size,))
 
-    if max_val == 1:
-        return random.choice([0, 1])
+    if (max_vals < min_vals).any():
+        raise ValueError("max is less than min")
 
-    if min_val == 0:
-        min_exp = 0
-    else:
-        min_exp = int(math.ceil(math.log10(min_val)))
-    max_exp = int(math.ceil(math.log10(max_val)))
-
-    # only pick 0 as an exponent a tenth as often as other exponents.
-    choices = []
-    for i in range(min_exp, max_exp + 1):
-        if i == 0:
-            choices.append(i)
-        else:
-            choices.extend([i] * 10)
-
-    base = random.choice(choices)
+    if (min_vals < 0).any():
+        raise ValueError(
+            "negative values not supported.")
 
-    if base > 0:
-        min_int = max(min_val, 10**(base-1))
-    else:
-        min_int = min_val
+    powers = numpy.asarray(POWERS_OF_TEN, dtype=numpy.int64)
+    min_exps = numpy.searchsorted(powers, min_vals)
+    counts = numpy.searchsorted(powers, max_vals) - min_exps + 1
 
-    max_int = min(10**base, max_val)
+    # A single possible value is returned without drawing anything.
+    where = min_vals != max_vals
+    picks = rng.random(where) * counts
+    accepts = rng.random(where)
+    indexes = numpy.floor(picks).astype(numpy.int64)
+    # Rows sharing an exponent table are looked up together.
+    tables = counts * 2 + (min_exps == 0)
+    for key in numpy.unique(tables).tolist():
+        table = get_exponent_table(1 - key % 2, key // 2)
+        rows = tables == key
+        row_indexes = indexes[rows]
+        probabilities = numpy.asarray(table.probabilities)[row_indexes]
+        aliases = numpy.asarray(table.aliases)[row_indexes]
+        indexes[rows] = numpy.where(
+            accepts[rows] < probabilities, row_indexes, aliases)
 
-    return random.randint(min_int, max_int)
+    bases = min_exps + indexes
+    min_ints = numpy.where(
+        bases > 0,
+        numpy.maximum(min_vals, powers[numpy.maximum(bases - 1, 0)]),
+        min_vals)
+    max_ints = numpy.minimum(powers[bases], max_vals)
+    values = min_ints + numpy.floor(
+        rng.random(where) * (max_ints - min_ints + 1)).astype(numpy.int64)
+    return numpy.where(where, values, min_vals)
 
 
-def random_fraction(max_val=12):
-    numerator = random_digit(max_val=max_val)
-    denominator = random_digit(min_val=1, max_val=max_val)
-    return Fraction(numerator, denominator)
+def random_fraction(max_val=12, rng=random):
+    return get_fraction_sampler(max_val).sample(rng)
 
 
 def find_next_multiple(number, factor, direction):
@@ -0,0 +1,95 @@
+import threading
+
+from mathquiz.instrument import timed
+
+
+class QuestionPrefetcher(object):
+    """Generates a quiz's upcoming questions on a background thread.
+
+    One question of each type is kept ready. The type of the next
+    question is still picked when it's asked for, from the weights as
+    they are after the latest answer. Since an answer changes the
+    difficulty of its question type, a ready question of that type is
+    thrown away and replaced.
+    """
+
+    def __init__(self, quiz, options):
+        self.quiz = quiz
+        self.options = options
+        # The quiz isn't thread safe, so it's only used under this lock.
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        # Question type name -> question
+        self.ready = {}
+        self.closed = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def missing_question_type(self):
+        for question_type in self.quiz.question_types:
+            if question_type.name not in self.ready:
+                return question_type
+        return None
+
+    def _run(self):
+        with self.lock:
+            while not self.closed:
+                question_type = self.missing_question_type()
+                if question_type is None:
+                    self.changed.wait()
+                    continue
+                try:
+                    question = self.quiz.generate_question(
+                        question_type, self.options)
+                except Exception:
+                    # get generates questions itself from now on, which
+                    # raises the error where it can be handled.
+                    return
+                self.ready[question_type.name] = question
+
+    @timed('prefetch.wait')
+    def get(self):
+        """Return the next question, generating it if it isn't ready."""
+        with self.lock:
+            question_type = self.quiz.pick_next_question_type()
+            question = self.ready.pop(question_type.name, None)
+            if question is None:
+                question = self.quiz.generate_question(
+                    question_type, self.options)
+            self.changed.notify()
+            return question
+
+    def record_result(self, question_result):
+        with self.lock:
+            self.quiz.record_result(question_result)
+            self.ready.pop(question_result.question_name, None)
+            self.changed.notify()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.changed.notify()
+        self.thread.join()
+
+
+class QuestionGenerator(object):
+    """Generates each question of a quiz when it's asked for.
+
+    Has the same interface as QuestionPrefetcher. Nothing is generated
+    ahead, so which questions a seeded quiz asks doesn't depend on
+    timing.
+    """
+
+    def __init__(self, quiz, options):
+        self.quiz = quiz
+        self.options = options
+
+    def get(self):
+        return self.quiz.next_question(self.options)
+
+    def record_result(self, question_result):
+        self.quiz.record_result(question_result)
+
+    def close(self):
+        pass
@@ -1,3 +1,5 @@
+import binascii
+import os
 import random
 import string
 import uuid
@@ -14,12 +16,59 @@ from abc import (
     )
 
 from mathquiz.math_helpers import (
+    SeededRandom,
+    SeededRandomBatch,
     add_time,
     find_next_multiple,
+    get_numpy,
     greatest_factor,
     random_digit,
+    random_digits,
     random_fraction,
     )
+from mathquiz.registry import load_question_type
+
+
+# Seeds are kept small, since they're stored with every result.
+SEED_BITS = 32
+
+
+def new_seed(rng=random):
+    return rng.getrandbits(SEED_BITS)
+
+
+def new_uuids(n):
+    """Return n random uuids like uuid.uuid4, made together.
+
+    Needs numpy."""
+    numpy = get_numpy()
+    data = numpy.frombuffer(
+        os.urandom(16 * n), dtype=numpy.uint8).reshape(n, 16).copy()
+    data[:, 6] = data[:, 6] & 0x0f | 0x40
+    data[:, 8] = data[:, 8] & 0x3f | 0x80
+    hexes = binascii.hexlify(data.tobytes()).decode('ascii')
+    return [
+        u'%s-%s-%s-%s-%s' % (
+            hexes[i:i + 8], hexes[i + 8:i + 12], hexes[i + 12:i + 16],
+            hexes[i + 16:i + 20], hexes[i + 20:i + 32])
+        for i in xrange(0, 32 * n, 32)]
+
+
+class QuestionNotReproducible(ValueError):
+    """Raised when a stored question can't be recreated, because its
+    generator has changed since so its seed no longer gives the same
+    question, or its type isn't installed any more."""
+
+
+def digits_range(digits, max_val):
+    """Return the range of numbers with the given number of digits,
+    limited to max_val."""
+    max_val = min(max_val, 10**digits - 1)
+    if digits > 1:
+        min_val = min(10**(digits - 1), max_val)
+    else:
+        min_val = 0
+    return min_val, max_val
 
 
 def setup_builtin_options(builtin_options, attrs):
@@ -75,18 +124,128 @@ class Question(object):
         }
     }
 
-    def __init__(self, options=None, properties=None):
+    # Maps each dimension questions can be made harder along to its
+    # (lowest, highest) level.
+    difficulty_dimensions = {}
+
+    # Version of the question generator. Types that draw only from
+    # self.rng set it, and their questions are stored as just the seed,
+    # options and difficulty they were generated from. It must be bumped
+    # whenever a change makes a seed generate a different question.
+    version = None
+
+    # Questions built from their properties have no seed.
+    seed = None
+
+    # Class of self.rng. Types that generate batches use SeededRandom,
+    # which can make the draws of many seeds at once.
+    random_class = random.Random
+
+    def __init__(self, options=None, properties=None, difficulty=None,
+                 seed=None):
         if options is None:
             self.provided_options = {}
         else:
             self.provided_options = options
+        if difficulty is None:
+            self.target_difficulty = {}
+        else:
+            self.target_difficulty = difficulty
+        # Not drawn from the seed: seeds are short enough to repeat
+        # between users, uuids mustn't.
         self.uuid = unicode(uuid.uuid4())
         if properties is None:
+            if seed is None:
+                seed = new_seed()
+            self.seed = seed
+            self.rng = self.new_rng(seed)
             self._generate()
+            # A generator holds a few KB of state, too much to keep with
+            # every question of a history.
+            del self.rng
         else:
             for key, value in properties.iteritems():
                 setattr(self, key, value)
 
+    @classmethod
+    def new_rng(cls, seed):
+        """Return the generator a question draws from for a seed."""
+        rng = cls.random_class(seed)
+        if cls.random_class is random.Random:
+            # The first 128 bits used to make the uuid. Skip them so
+            # stored seeds still give the same questions.
+            rng.getrandbits(128)
+        return rng
+
+    @classmethod
+    def generate_batch(cls, n, options=None, difficulty=None, rng=random):
+        """Generate n questions of this type.
+
+        Each gets a seed from rng, as in Quiz.generate_question, so it
+        can be regenerated from it. Types defining _generate_columns
+        generate them all at once when numpy is available."""
+        seeds = [new_seed(rng) for _ in xrange(n)]
+        columns = None
+        if get_numpy() is not None:
+            columns = cls._generate_columns(
+                SeededRandomBatch(seeds), options or {}, difficulty or {})
+        if columns is None:
+            return [cls(options, difficulty=difficulty, seed=seed)
+                    for seed in seeds]
+        return cls._from_columns(seeds, options, difficulty, columns)
+
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        """Generate a question for each seed of a SeededRandomBatch.
+
+        Returns a dict mapping each property to a list of its values,
+        the same as _generate would give, or None when the type can't
+        generate batches."""
+        return None
+
+    @classmethod
+    def _from_columns(cls, seeds, options, difficulty, columns):
+        """Build generated questions without running _generate again."""
+        if options is None:
+            options = {}
+        if difficulty is None:
+            difficulty = {}
+        names = columns.keys()
+        questions = []
+        for seed, question_uuid, values in zip(
+                seeds, new_uuids(len(seeds)),
+                zip(*[columns[name] for name in names])):
+            question = cls.__new__(cls)
+            question.__dict__.update(zip(names, values))
+            question.provided_options = options
+            question.target_difficulty = difficulty
+            question.seed = seed
+            question.uuid = question_uuid
+            questions.append(question)
+        return questions
+
+    @classmethod
+    def from_seed(cls, seed, version, options=None, difficulty=None):
+        """Generate the question a seed gave with the given generator
+        version."""
+        if version != cls.version:
+            raise QuestionNotReproducible(
+                "Can't regenerate %s questions of version %s with version "
+                "%s" % (cls.name, version, cls.version))
+        return cls(options, difficulty=difficulty, seed=seed)
+
+    def is_reproducible(self):
+        return self.seed is not None and self.version is not None
+
+    def resolved_options(self):
+        """Return the value of every option, given or default.
+
+        Defaults are included so changing one doesn't change the
+        questions regenerated from stored seeds."""
+        return {
+            option_name: self.option_get(option_name)
+            for option_name in self.options}
+
     @abstractproperty
     def name(self):
         """A short name to be used in option generation."""
@@ -123,6 +282,24 @@ class Question(object):
             return self.provided_options[option_name]
         return self.options[option_name]['default']
 
+    @classmethod
+    def batch_option_get(cls, options, option_name):
+        if option_name in options:
+            return options[option_name]
+        return cls.options[option_name]['default']
+
+    def difficulty(self):
+        """Return the level of the question along each difficulty
+        dimension."""
+        return {}
+
+    def properties(self):
+        """Return the generated attributes of the question."""
+        return {
+            key: value for key, value in vars(self).iteritems()
+            if key not in (
+                'provided_options', 'target_difficulty', 'uuid', 'seed')}
+
 
 class BaseComparison(Question):
     """Compare two values using <, > and =."""
@@ -130,12 +307,12 @@ class BaseComparison(Question):
     name = "base-comparison"
 
     def _generator(self):
-        return self.generator.__func__()
+        return self.generator.__func__(rng=self.rng)
 
     def _generate(self):
         self.a = self._generator()
 
-        if random.randint(0, 4) == 0:
+        if self.rng.randint(0, 4) == 0:
             self.b = self.a
             self.answer = '='
             return
@@ -159,24 +336,35 @@ class BaseComparison(Question):
 
 class IntegerComparison(BaseComparison):
     name = "integer-comparison"
+    version = 1
     generator = random_digit
 
 
 class FractionComparison(BaseComparison):
     name = "fraction-comparison"
+    version = 1
     generator = random_fraction
 
 
 class Exponent(Question):
     name = "exponent"
+    version = 2
+    random_class = SeededRandom
     max_val = 9
 
     def _generate(self):
         max_val = self.option_get('max_val')
-        self.a = random_digit(max_val=max_val)
-        self.b = random_digit(max_val=4)
+        self.a = random_digit(max_val=max_val, rng=self.rng)
+        self.b = random_digit(max_val=4, rng=self.rng)
         self.answer = self.a ** self.b
 
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        max_val = cls.batch_option_get(options, 'max_val')
+        a = random_digits(rng, max_val=max_val).tolist()
+        b = random_digits(rng, max_val=4).tolist()
+        return {'a': a, 'b': b, 'answer': [x ** y for x, y in zip(a, b)]}
+
     def explain(self):
         return "Exponent: raise a number to the given power."
 
@@ -186,14 +374,40 @@ class Exponent(Question):
 
 class Addition(Question):
     name = "addition"
+    version = 2
+    random_class = SeededRandom
     max_val = 100000
+    difficulty_dimensions = {'digits': (1, 6)}
 
     def _generate(self):
         max_val = self.option_get('max_val')
-        self.a = random_digit(max_val=max_val)
-        self.b = random_digit(max_val=max_val)
+        min_val = 0
+        if 'digits' in self.target_difficulty:
+            min_val, max_val = digits_range(
+                self.target_difficulty['digits'], max_val)
+        # Only one of the operands needs to be of the target size.
+        sized = random_digit(min_val=min_val, max_val=max_val, rng=self.rng)
+        other = random_digit(max_val=max_val, rng=self.rng)
+        self.a, self.b = self.rng.choice([(sized, other), (other, sized)])
         self.answer = self.a + self.b
 
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        numpy = get_numpy()
+        max_val = cls.batch_option_get(options, 'max_val')
+        min_val = 0
+        if 'digits' in difficulty:
+            min_val, max_val = digits_range(difficulty['digits'], max_val)
+        sized = random_digits(rng, min_val=min_val, max_val=max_val)
+        other = random_digits(rng, max_val=max_val)
+        swapped = rng.randbelow(2) == 1
+        a = numpy.where(swapped, other, sized).tolist()
+        b = numpy.where(swapped, sized, other).tolist()
+        return {'a': a, 'b': b, 'answer': [x + y for x, y in zip(a, b)]}
+
+    def difficulty(self):
+        return {'digits': len(str(max(self.a, self.b)))}
+
     def explain(self):
         return "Add the two numbers."
 
@@ -203,11 +417,12 @@ class Addition(Question):
 
 class NextMultiple(Question):
     name = "next-multiple"
+    version = 1
 
     def _generate(self):
-        self.number = random_digit(min_val=1)
-        self.factor = random.choice([10, 100, 10000])
-        self.direction = random.choice(['up', 'down'])
+        self.number = random_digit(min_val=1, rng=self.rng)
+        self.factor = self.rng.choice([10, 100, 10000])
+        self.direction = self.rng.choice(['up', 'down'])
         self.answer = find_next_multiple(
             self.number, self.factor, self.direction)
 
@@ -223,17 +438,33 @@ class NextMultiple(Question):
 
 class CountBy(Question):
     name = "count-by"
+    version = 1
+    difficulty_dimensions = {'count_by': (1, 9), 'iterations': (1, 9)}
 
     """Count by an integer"""
     def _generate(self):
-        self.offset = random.randint(0, 9)
-        self.count_by = random.randint(1, 9)
-        iterations = random.randint(1, 9)
+        self.offset = self.rng.randint(0, 9)
+        self.count_by = self.difficulty_randint('count_by', 1, 9)
+        iterations = self.difficulty_randint('iterations', 1, 9)
         self.answer_list = [
             "%d" % (self.offset + self.count_by * i)
             for i in range(0, iterations)]
         self.answer = " ".join(self.answer_list)
 
+    def difficulty_randint(self, dimension, lowest, highest):
+        """Pick a value near the target level, or any value without one."""
+        if dimension in self.target_difficulty:
+            level = self.target_difficulty[dimension]
+            lowest = max(lowest, level - 1)
+            highest = min(highest, level + 1)
+        return self.rng.randint(lowest, highest)
+
+    def difficulty(self):
+        return {
+            'count_by': self.count_by,
+            'iterations': len(self.answer_list),
+        }
+
     def explain(self):
         return ("Count by a number from one number to another. For example, "
                 "count by 5's starting at 3 up to 23: 3 8 13 18 23")
@@ -246,7 +477,7 @@ class CountBy(Question):
 class BaseMultiplication(Question):
 
     def _generator(self, *args, **kwargs):
-        return self.generator.__func__(*args, **kwargs)
+        return self.generator.__func__(rng=self.rng, *args, **kwargs)
 
     def _generate(self):
         max_val = self.option_get('max_val')
@@ -263,12 +494,22 @@ class BaseMultiplication(Question):
 
 class IntegerMultiplication(BaseMultiplication):
     name = "integer_multiplication"
+    version = 2
+    random_class = SeededRandom
     generator = random_digit
     max_val = 9
 
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        max_val = cls.batch_option_get(options, 'max_val')
+        a = random_digits(rng, max_val=max_val).tolist()
+        b = random_digits(rng, max_val=max_val).tolist()
+        return {'a': a, 'b': b, 'answer': [x * y for x, y in zip(a, b)]}
+
 
 class FractionMultiplication(BaseMultiplication):
     name = "fraction_multiplication"
+    version = 1
     generator = random_fraction
     max_val = 9
 
@@ -283,14 +524,35 @@ class FractionMultiplication(BaseMultiplication):
 
 class Subtraction(Question):
     name = "subtraction"
+    version = 2
+    random_class = SeededRandom
     max_val = 100000
+    difficulty_dimensions = {'digits': (1, 6)}
 
     def _generate(self):
         max_val = self.option_get('max_val')
-        self.a = random_digit(max_val=max_val)
-        self.b = random_digit(max_val=self.a)
+        min_val = 0
+        if 'digits' in self.target_difficulty:
+            min_val, max_val = digits_range(
+                self.target_difficulty['digits'], max_val)
+        self.a = random_digit(min_val=min_val, max_val=max_val, rng=self.rng)
+        self.b = random_digit(max_val=self.a, rng=self.rng)
         self.answer = self.a - self.b
 
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        max_val = cls.batch_option_get(options, 'max_val')
+        min_val = 0
+        if 'digits' in difficulty:
+            min_val, max_val = digits_range(difficulty['digits'], max_val)
+        a = random_digits(rng, min_val=min_val, max_val=max_val)
+        b = random_digits(rng, max_val=a).tolist()
+        a = a.tolist()
+        return {'a': a, 'b': b, 'answer': [x - y for x, y in zip(a, b)]}
+
+    def difficulty(self):
+        return {'digits': len(str(self.a))}
+
     def explain(self):
         return "Find the difference."
 
@@ -300,10 +562,11 @@ class Subtraction(Question):
 
 class Rounding(Question):
     name = "rounding"
+    version = 1
 
     def _generate(self):
-        self.number = random_digit()
-        self.round_to = random.choice(range(-4, -1))
+        self.number = random_digit(rng=self.rng)
+        self.round_to = self.rng.choice(range(-4, -1))
         self.answer = int(round(self.number, self.round_to))
 
     def explain(self):
@@ -318,6 +581,7 @@ class Rounding(Question):
 
 class DivisionRemainder(Question):
     name = "division_remainder"
+    version = 1
     max_dividend = 999
     max_divisor = 9
 
@@ -325,9 +589,9 @@ class DivisionRemainder(Question):
         max_dividend = self.option_get('max_dividend')
         max_divisor = self.option_get('max_divisor')
         self.divisor = random_digit(
-            min_val=1, max_val=max_divisor)
+            min_val=1, max_val=max_divisor, rng=self.rng)
         self.dividend = random_digit(
-            min_val=self.divisor, max_val=max_dividend)
+            min_val=self.divisor, max_val=max_dividend, rng=self.rng)
         whole_part = self.dividend / self.divisor
         remainder = self.dividend % self.divisor
         self.answer = "%dr%d" % (whole_part, remainder)
@@ -344,6 +608,7 @@ class DivisionRemainder(Question):
 
 class Division(Question):
     name = "division"
+    version = 1
     max_dividend = 999
     max_divisor = 9
 
@@ -351,10 +616,10 @@ class Division(Question):
         max_dividend = self.option_get('max_dividend')
         max_divisor = self.option_get('max_divisor')
         self.divisor = random_digit(
-            min_val=1, max_val=max_divisor)
+            min_val=1, max_val=max_divisor, rng=self.rng)
         max_answer = max_dividend / self.divisor
         self.answer = random_digit(
-            max_val=max_answer)
+            max_val=max_answer, rng=self.rng)
         self.dividend = self.divisor * self.answer
 
     def explain(self):
@@ -369,18 +634,35 @@ class Division(Question):
 
 class Modulo(Question):
     name = "modulo"
+    version = 2
+    random_class = SeededRandom
     max_val = 24
 
     def _generate(self):
         max_val = self.option_get('max_val')
         self.divisor = random_digit(
             min_val=1,
-            max_val=max_val)
+            max_val=max_val,
+            rng=self.rng)
         self.dividend = random_digit(
             min_val=self.divisor,
-            max_val=max_val)
+            max_val=max_val,
+            rng=self.rng)
         self.answer = self.dividend % self.divisor
 
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        max_val = cls.batch_option_get(options, 'max_val')
+        divisor = random_digits(rng, min_val=1, max_val=max_val)
+        dividend = random_digits(
+            rng, min_val=divisor, max_val=max_val).tolist()
+        divisor = divisor.tolist()
+        return {
+            'divisor': divisor,
+            'dividend': dividend,
+            'answer': [x % y for x, y in zip(dividend, divisor)],
+        }
+
     def explain(self):
         return "Find the remainder"
 
@@ -393,14 +675,23 @@ class Modulo(Question):
 
 class Gcd(Question):
     name = "gcd"
+    version = 2
+    random_class = SeededRandom
     max_val = 20
 
     def _generate(self):
         max_val = self.option_get('max_val')
-        self.a = random_digit(max_val=max_val)
-        self.b = random_digit(max_val=max_val)
+        self.a = random_digit(max_val=max_val, rng=self.rng)
+        self.b = random_digit(max_val=max_val, rng=self.rng)
         self.answer = gcd(self.a, self.b)
 
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        max_val = cls.batch_option_get(options, 'max_val')
+        a = random_digits(rng, max_val=max_val).tolist()
+        b = random_digits(rng, max_val=max_val).tolist()
+        return {'a': a, 'b': b, 'answer': [gcd(x, y) for x, y in zip(a, b)]}
+
     def explain(self):
         return "Find the greatest common denominator"
 
@@ -413,11 +704,12 @@ class Gcd(Question):
 
 class GreatestFactor(Question):
     name = "greatest-factor"
+    version = 1
     max_val = 20
 
     def _generate(self):
         max_val = self.option_get('max_val')
-        self.a = random_digit(min_val=1, max_val=max_val)
+        self.a = random_digit(min_val=1, max_val=max_val, rng=self.rng)
         self.answer = greatest_factor(self.a)
 
     def explain(self):
@@ -430,9 +722,18 @@ class GreatestFactor(Question):
 
 
 class RectangleQuestion(Question):
+    random_class = SeededRandom
+
     def _generate(self):
-        self.height = random_digit(min_val=1, max_val=12)
-        self.width = random_digit(min_val=1, max_val=12)
+        self.height = random_digit(min_val=1, max_val=12, rng=self.rng)
+        self.width = random_digit(min_val=1, max_val=12, rng=self.rng)
+
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        return {
+            'height': random_digits(rng, min_val=1, max_val=12).tolist(),
+            'width': random_digits(rng, min_val=1, max_val=12).tolist(),
+        }
 
     @property
     def graphic_cue(self):
@@ -441,12 +742,21 @@ class RectangleQuestion(Question):
 
 class RectangularArea(RectangleQuestion):
     name = "rectangular-area"
+    version = 2
     max_val = 12
 
     def _generate(self):
         super(RectangularArea, self)._generate()
         self.answer = self.height * self.width
 
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        columns = super(RectangularArea, cls)._generate_columns(
+            rng, options, difficulty)
+        columns['answer'] = [
+            x * y for x, y in zip(columns['height'], columns['width'])]
+        return columns
+
     def explain(self):
         return "Find the area of the rectangle."
 
@@ -465,12 +775,21 @@ class RectangularArea(RectangleQuestion):
 
 class RectangularPerimeter(RectangleQuestion):
     name = "rectangular-perimeter"
+    version = 2
     max_val = 12
 
     def _generate(self):
         super(RectangularPerimeter, self)._generate()
         self.answer = 2 * (self.height + self.width)
 
+    @classmethod
+    def _generate_columns(cls, rng, options, difficulty):
+        columns = super(RectangularPerimeter, cls)._generate_columns(
+            rng, options, difficulty)
+        columns['answer'] = [
+            2 * (x + y) for x, y in zip(columns['height'], columns['width'])]
+        return columns
+
     def explain(self):
         return "Find the perimeter of the rectangle."
 
@@ -483,10 +802,11 @@ class RectangularPerimeter(RectangleQuestion):
 
 class ReadAnalogClock(Question):
     name = "read_analog_clock"
+    version = 1
 
     def _generate(self):
-        self.hours = random_digit(min_val=1, max_val=12)
-        self.minutes = random.choice(range(0, 60, 5))
+        self.hours = random_digit(min_val=1, max_val=12, rng=self.rng)
+        self.minutes = self.rng.choice(range(0, 60, 5))
         self.answer = "%d:%02d" % (self.hours, self.minutes)
 
     def explain(self):
@@ -503,12 +823,13 @@ class ReadAnalogClock(Question):
 
 class AddTime(Question):
     name = "add_time"
+    version = 1
 
     def _generate(self):
-        self.start_hours = random_digit(min_val=1, max_val=12)
-        self.start_minutes = random.choice(range(0, 60))
-        self.delta_hours = random_digit(min_val=1, max_val=12)
-        self.delta_minutes = random.choice(range(0, 60))
+        self.start_hours = random_digit(min_val=1, max_val=12, rng=self.rng)
+        self.start_minutes = self.rng.choice(range(0, 60))
+        self.delta_hours = random_digit(min_val=1, max_val=12, rng=self.rng)
+        self.delta_minutes = self.rng.choice(range(0, 60))
         self.answer = "%d:%02d" % add_time(
             self.start_hours, self.start_minutes,
             self.delta_hours, self.delta_minutes)
@@ -525,12 +846,13 @@ class AddTime(Question):
 
 class SubtractTime(Question):
     name = "subtract_time"
+    version = 1
 
     def _generate(self):
-        self.start_hours = random_digit(min_val=1, max_val=12)
-        self.start_minutes = random.choice(range(0, 60))
-        self.delta_hours = random_digit(min_val=1, max_val=12)
-        self.delta_minutes = random.choice(range(0, 60))
+        self.start_hours = random_digit(min_val=1, max_val=12, rng=self.rng)
+        self.start_minutes = self.rng.choice(range(0, 60))
+        self.delta_hours = random_digit(min_val=1, max_val=12, rng=self.rng)
+        self.delta_minutes = self.rng.choice(range(0, 60))
         self.answer = "%d:%02d" % add_time(
             self.start_hours, self.start_minutes,
             -self.delta_hours, -self.delta_minutes)
@@ -545,6 +867,12 @@ class SubtractTime(Question):
             self.start_hours, self.start_minutes)
 
 
+def get_question_type(question_name):
+    if question_name in question_types_by_name:
+        return question_types_by_name[question_name]
+    return load_question_type(question_name)
+
+
 def question_name_to_class_name(question_name):
     return question_name.title().replace('-', '').replace('_', '')
 
@@ -571,3 +899,8 @@ builtin_question_types = [
     SubtractTime,
     DivisionRemainder,
     ]
+
+
+question_types_by_name = {
+    question_type.name: question_type
+    for question_type in builtin_question_types}
@@ -1,59 +1,120 @@
 import random
 
-from mathquiz.stats import (
-    group_by_mastery,
-    questions_from_user_data,
-    )
-
+from argparse import Namespace
+from collections import OrderedDict
 
+from mathquiz.difficulty import DifficultyRatings
+from mathquiz.instrument import (
+    count,
+    timed,
+    )
+from mathquiz.mastery import MASTERY_SIZE
+from mathquiz.questions import new_seed
+from mathquiz.registry import get_question_types
+from mathquiz.scheduler import WeightedScheduler
 from mathquiz.storage import (
     add_unanswered_question,
-    get_current_user_data,
+    get_difficulty_ratings,
+    get_mastery_index,
     )
 
 
+# Weight of a question type that was missed every time recently,
+# relative to one that was always answered correctly.
 UNMASTERED_BOOST = 5
 
 
 class Quiz(object):
-    def __init__(self, question_types, user_data):
+    def __init__(self, question_types, mastery_index,
+                 difficulty_ratings=None, seed=None):
         self.question_types = question_types
-        self.user_data = user_data
-        self.weighted_question_types = self.get_weighted_question_types()
-
-    def get_weighted_question_types(self):
-        question_history = questions_from_user_data(self.user_data)
-        question_types_by_mastery = group_by_mastery(
-            self.question_types, question_history)
-        weighted_questions = []
-        for question_type in question_types_by_mastery['mastered']:
-            weighted_questions.append(question_type)
-        for question_type in question_types_by_mastery['unmastered']:
-            weighted_questions.extend([question_type] * UNMASTERED_BOOST)
-        return weighted_questions
+        # Picks question types and the seed of each question, so a quiz
+        # given the same seed and answers asks the same questions.
+        self.rng = random.Random(seed)
+        self.question_types_by_name = {
+            question_type.name: question_type
+            for question_type in question_types}
+        self.mastery_index = mastery_index
+        if difficulty_ratings is None:
+            self.difficulty_ratings = DifficultyRatings()
+        else:
+            self.difficulty_ratings = difficulty_ratings
+        self.scheduler = WeightedScheduler(
+            self.get_question_type_weights())
+
+    def question_type_weight(self, question_type):
+        """Weight a question type by how often it was recently missed.
+
+        Questions not yet answered MASTERY_SIZE times count as missed, so
+        new question types come up often.
+        """
+        missed = MASTERY_SIZE - self.mastery_index.correct(question_type.name)
+        return 1 + (UNMASTERED_BOOST - 1) * missed / float(MASTERY_SIZE)
 
+    def get_question_type_weights(self):
+        # In the order of question_types, so a seeded quiz samples the
+        # same way in every process.
+        return OrderedDict(
+            (question_type, self.question_type_weight(question_type))
+            for question_type in self.question_types)
+
+    @timed('quiz.pick_question_type')
     def pick_next_question_type(self):
-        question_type = random.choice(self.weighted_question_types)
-        return question_type
+        return self.scheduler.sample(self.rng)
+
+    @timed('quiz.record_result')
+    def record_result(self, question_result):
+        """Update question type weights and difficulty ratings after a
+        question is answered."""
+        self.mastery_index.record(
+            question_result.question_name, question_result.result)
+        self.difficulty_ratings.record_result(question_result)
+        question_type = self.question_types_by_name.get(
+            question_result.question_name)
+        if question_type is not None:
+            self.scheduler.set_weight(
+                question_type, self.question_type_weight(question_type))
+
+    def next_question(self, options):
+        question_type = self.pick_next_question_type()
+        return self.generate_question(question_type, options)
 
     def questions(self, question_count, options):
         for _ in xrange(question_count):
-            question_type = self.pick_next_question_type()
-            yield self.generate_question(question_type, options)
+            yield self.next_question(options)
 
+    @timed('quiz.generate_question')
     def generate_question(self, question, options):
+        count('questions.generated')
         option_vars = vars(options)
         module_name = "%s_" % (question.name)
         question_options = {
             arg[len(module_name):]: value
             for arg, value in option_vars.iteritems()
             if arg.startswith("%s_" % (question.name))}
-        return question(question_options)
+        return question(
+            question_options,
+            difficulty=self.difficulty_ratings.target_difficulty(question),
+            seed=new_seed(self.rng))
+
+
+def get_default_options(question_types):
+    """Options for generate_question with every question option at its
+    default."""
+    options = Namespace()
+    for question_type in question_types:
+        for option_name, option in question_type.options.iteritems():
+            setattr(
+                options, "%s_%s" % (question_type.name, option_name),
+                option['default'])
+    return options
 
 
 def get_next_question_by_history(user):
-    user_data = get_current_user_data(user)
-    quiz = Quiz(builtin_question_types, user_data)
-    [question] = quiz.questions(1, defaultoptions)
+    mastery_index = get_mastery_index(user)
+    difficulty_ratings = get_difficulty_ratings(user)
+    question_types = get_question_types()
+    quiz = Quiz(question_types, mastery_index, difficulty_ratings)
+    question = quiz.next_question(get_default_options(question_types))
     add_unanswered_question(user, question)
     return question
@@ -1,13 +1,24 @@
 import random
-import subprocess
 
+from mathquiz.instrument import (
+    count,
+    span,
+    )
+from mathquiz.prefetch import (
+    QuestionGenerator,
+    QuestionPrefetcher,
+    )
 from mathquiz.quiz import Quiz
+from mathquiz.registry import get_question_types
 from mathquiz.results import (
     QuestionResult,
     QuizResult,
     )
+from mathquiz.speech import SpeechWorker
 from mathquiz.storage import (
-    get_current_user_data,
+    get_difficulty_ratings,
+    get_mastery_index,
+    get_storage,
     store_quiz_results_local,
     )
 
@@ -33,26 +44,29 @@ bad_names = [
     ]
 
 
+def get_fixed_phrases():
+    """Feedback that doesn't depend on the question."""
+    return ["Correct, %s!" % name for name in good_names]
+
+
 def print_quiz_result(quiz_result):
     print("You got %d out of %d questions right!" % (
         quiz_result.num_correct, quiz_result.num_questions))
 
 
-def add_argument_from_option(parser, module_name, option):
-    parser.add_argument(
-        "--%s-%s" % (module_name, option['name']),
-        help=option['help'],
-        default=option['default'],
-        type=option.get('type', str),
-        )
-
-
 class ConsoleQuizRunner(object):
-    def __init__(self, question_types):
+    def __init__(self, question_types, speech_backend=None):
         self.question_types = question_types
+        self.speech_backend = speech_backend
+        self.speech = None
 
     def run(self, args):
-        user_data = get_current_user_data(args.user)
+        if args.replay is not None:
+            self.replay(args.user, args.replay)
+            return
+
+        mastery_index = get_mastery_index(args.user)
+        difficulty_ratings = get_difficulty_ratings(args.user)
         if args.include is not None:
             question_types = [
                 question_type for question_type
@@ -60,53 +74,87 @@ class ConsoleQuizRunner(object):
                 if question_type.name in args.include]
         else:
             question_types = self.question_types
-        quiz = Quiz(question_types, user_data)
-        results = self.run_quiz(quiz, args)
-        store_quiz_results_local(args.user, results)
-        print_quiz_result(results)
+        quiz = Quiz(
+            question_types, mastery_index, difficulty_ratings, args.seed)
+        self.speech = SpeechWorker(self.speech_backend)
+        self.speech.prewarm(get_fixed_phrases())
+        try:
+            results = self.run_quiz(quiz, args)
+            store_quiz_results_local(args.user, results)
+            print_quiz_result(results)
+        finally:
+            self.speech.close()
+
+    def replay(self, user, quiz_number):
+        """Ask the questions of one of a user's quizes again, without
+        storing the answers."""
+        quiz_results = list(get_storage().iter_results(user))
+        try:
+            quiz_result = quiz_results[quiz_number]
+        except IndexError:
+            print("%s has no quiz %d to replay." % (user, quiz_number))
+            return
+
+        self.speech = SpeechWorker(self.speech_backend)
+        self.speech.prewarm(get_fixed_phrases())
+        try:
+            results = []
+            for number, question_result in enumerate(
+                    quiz_result.results, 1):
+                question = question_result.question
+                if question is None:
+                    print("Skipping %s question %d, which can no longer "
+                          "be generated." % (
+                              question_result.question_name, number))
+                    continue
+                answer, result = self.ask_question(question)
+                results.append(QuestionResult(question, answer, result))
+            print_quiz_result(QuizResult(results))
+        finally:
+            self.speech.close()
 
     def run_quiz(self, quiz, args):
         results = []
         questions_left = args.num_questions
-        while questions_left > 0:
-            for question in quiz.questions(questions_left, args):
+        if args.seed is None:
+            prefetcher = QuestionPrefetcher(quiz, args)
+        else:
+            prefetcher = QuestionGenerator(quiz, args)
+        try:
+            while questions_left > 0:
+                question = prefetcher.get()
                 answer, result = self.ask_question(question)
-                results.append(QuestionResult(question, answer, result))
+                question_result = QuestionResult(question, answer, result)
+                results.append(question_result)
+                prefetcher.record_result(question_result)
                 if result == 0:
                     print("Adding two more questions for incorrect answer!")
                     questions_left += 1
                 else:
                     questions_left -= 1
                 print("Only %d questions left!" % (questions_left))
+        finally:
+            prefetcher.close()
         return QuizResult(results)
 
-    def setup_parser(self, parser):
-        parser.help = "Enjoy a math quiz."
-        parser.add_argument(
-            "-n", "--num_questions",
-            help="Number of questions in the quiz.", default=10, type=int)
-        parser.add_argument(
-            "-i", "--include", nargs="+",
-            help="questions to include. by default, all are included.")
-        parser.set_defaults(func=self.run)
-        self.add_question_args(parser)
-
-    def add_question_args(self, parser):
-        for question_type in self.question_types:
-            for option_name, option in question_type.options.iteritems():
-                option['name'] = option_name
-                add_argument_from_option(parser, question_type.name, option)
-
     def report(self, text):
         print(text)
-        subprocess.check_call(['espeak', text])
+        self.speech.say(text)
 
     def ask_question(self, question):
         print(question.explain())
         answer = raw_input(question.question_string())
-        if not question.check_answer(answer):
+        with span('question.check_answer'):
+            correct = question.check_answer(answer)
+        if not correct:
+            count('answers.wrong')
             self.report("Wrong, %s! The correct answer is: %s" % (
                 random.choice(bad_names), question.answer))
             return answer, 0
+        count('answers.correct')
         self.report("Correct, %s!" % (random.choice(good_names)))
         return answer, 1
+
+
+def run(args):
+    ConsoleQuizRunner(get_question_types(args.include)).run(args)
@@ -0,0 +1,271 @@
+import importlib
+import json
+import os
+import sys
+
+from mathquiz.config import get_local_storage_dir
+from mathquiz.locking import atomic_write
+
+
+# Bump when the layout of the cached index changes.
+QUESTION_INDEX_VERSION = 3
+
+QUESTION_INDEX_PATH = "question_types.json"
+
+QUESTIONS_MODULE = "mathquiz.questions"
+
+# Packages add question types by naming their classes under this entry
+# point group, e.g. in setup.py:
+#     entry_points={'mathquiz.question_types': [
+#         'long-division = mathquiz_extra.questions:LongDivision']}
+ENTRY_POINT_GROUP = "mathquiz.question_types"
+
+# Names of the metadata of installed distributions in a path directory.
+DISTRIBUTION_SUFFIXES = ('.dist-info', '.egg-info', '.egg-link', '.egg')
+
+# Option types by the name the index stores them under.
+option_types = {
+    'int': int,
+    'float': float,
+    'str': str,
+}
+
+
+_question_index = None
+_question_types = None
+
+
+def get_question_index_path():
+    return os.path.join(get_local_storage_dir(), QUESTION_INDEX_PATH)
+
+
+def get_questions_fingerprint(index):
+    """Identify the installed question types, without importing them.
+
+    That's the question module source, the distributions installed on
+    the path, and the entry points of those providing the question types
+    in index, which change when a plugin installed for development is
+    edited. Other files on the path, like those in the working
+    directory, don't count. The directory of the script being run is
+    left out, since it differs between commands.
+    """
+    path = os.path.join(os.path.dirname(__file__), "questions.py")
+    stat = os.stat(path)
+    fingerprint = [QUESTION_INDEX_VERSION, stat.st_mtime, stat.st_size]
+    for path_dir in sys.path[1:]:
+        if os.path.isdir(path_dir):
+            fingerprint.append([path_dir, sorted(
+                name for name in os.listdir(path_dir)
+                if name.endswith(DISTRIBUTION_SUFFIXES))])
+    for description in index:
+        if description['entry_points'] is not None:
+            try:
+                mtime = os.stat(description['entry_points']).st_mtime
+            except OSError:
+                mtime = None
+            fingerprint.append([description['entry_points'], mtime])
+    return fingerprint
+
+
+def describe_question_type(question_type, distribution=None,
+                           entry_points=None):
+    options = {}
+    for option_name, option in question_type.options.iteritems():
+        type_name = option.get('type', str).__name__
+        if type_name not in option_types:
+            raise ValueError(
+                "Unsupported type %s for option %s of %s" % (
+                    type_name, option_name, question_type.name))
+        options[option_name] = {
+            'help': option['help'],
+            'type': type_name,
+            'default': option['default'],
+        }
+    doc = (question_type.__doc__ or "").strip()
+    return {
+        'name': question_type.name,
+        'module': question_type.__module__,
+        'class': question_type.__name__,
+        'distribution': distribution,
+        'entry_points': entry_points,
+        'description': doc.split("\n")[0],
+        'options': options,
+        'difficulty_dimensions': question_type.difficulty_dimensions,
+    }
+
+
+def iter_entry_points():
+    # pkg_resources scans every installed distribution, so it's only
+    # imported when the index is rebuilt.
+    try:
+        pkg_resources = importlib.import_module('pkg_resources')
+    except ImportError:
+        return []
+    return pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+
+
+def get_entry_points_path(distribution):
+    # Only distributions installed as files have one.
+    metadata_dir = getattr(distribution, 'egg_info', None)
+    if metadata_dir is None:
+        return None
+    return os.path.join(metadata_dir, "entry_points.txt")
+
+
+def build_question_index():
+    questions = importlib.import_module(QUESTIONS_MODULE)
+    index = [
+        describe_question_type(question_type)
+        for question_type in questions.builtin_question_types]
+    names = set(description['name'] for description in index)
+
+    for entry_point in iter_entry_points():
+        try:
+            question_type = entry_point.load()
+            description = describe_question_type(
+                question_type, str(entry_point.dist),
+                get_entry_points_path(entry_point.dist))
+        except Exception as error:
+            sys.stderr.write("Skipping question type %s: %s\n" % (
+                entry_point.name, error))
+            continue
+        if description['name'] in names:
+            sys.stderr.write(
+                "Skipping question type %s from %s: name already used\n" % (
+                    description['name'], entry_point.dist))
+            continue
+        names.add(description['name'])
+        index.append(description)
+    return index
+
+
+def load_question_index():
+    """Return the description of every question type.
+
+    It's cached in the storage directory, so listing the options of the
+    run command doesn't import the question classes. The cache is
+    rebuilt whenever the question module changes or packages are
+    installed.
+    """
+    global _question_index
+    if _question_index is not None:
+        return _question_index
+
+    path = get_question_index_path()
+    try:
+        with open(path) as index_file:
+            cached = json.load(index_file)
+        if cached['fingerprint'] == get_questions_fingerprint(
+                cached['question_types']):
+            _question_index = cached['question_types']
+            return _question_index
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    index = build_question_index()
+    fingerprint = get_questions_fingerprint(index)
+    try:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        atomic_write(path, [json.dumps(
+            {'fingerprint': fingerprint, 'question_types': index},
+            sort_keys=True)])
+    except (IOError, OSError):
+        # A read-only home only makes the next start slower.
+        pass
+    _question_index = index
+    return index
+
+
+class QuestionTypeRef(object):
+    """Stands in for a question type, importing it on first use.
+
+    The name, options and difficulty dimensions come from the index, so
+    a quiz can weigh and configure types without importing them. Calling
+    the reference, or using any other attribute, imports the class.
+    """
+
+    def __init__(self, description):
+        self.description = description
+        self.name = description['name']
+        self.options = description['options']
+        self.difficulty_dimensions = description['difficulty_dimensions']
+        self.question_class = None
+
+    def load(self):
+        if self.question_class is None:
+            module = importlib.import_module(self.description['module'])
+            self.question_class = getattr(module, self.description['class'])
+        return self.question_class
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name == 'question_class' or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "<QuestionTypeRef %s>" % self.name
+
+
+def get_question_types(names=None):
+    """Return references to every question type, or those named."""
+    global _question_types
+    if _question_types is None:
+        _question_types = [
+            QuestionTypeRef(description)
+            for description in load_question_index()]
+    if names is None:
+        return list(_question_types)
+    return [
+        question_type for question_type in _question_types
+        if question_type.name in names]
+
+
+def load_question_type(name):
+    """Import and return the question type with the given name."""
+    for question_type in get_question_types([name]):
+        return question_type.load()
+    raise KeyError(name)
+
+
+def add_argument_from_option(parser, module_name, option):
+    parser.add_argument(
+        "--%s-%s" % (module_name, option['name']),
+        help=option['help'],
+        default=option['default'],
+        type=option_types[option.get('type', 'str')],
+        )
+
+
+def add_question_args(parser, index):
+    for description in index:
+        for option_name, option in sorted(description['options'].iteritems()):
+            option = dict(option, name=option_name)
+            add_argument_from_option(parser, description['name'], option)
+
+
+def setup_run_parser(parser):
+    parser.help = "Enjoy a math quiz."
+    parser.add_argument(
+        "-n", "--num_questions",
+        help="Number of questions in the quiz.", default=10, type=int)
+    parser.add_argument(
+        "-i", "--include", nargs="+",
+        help="questions to include. by default, all are included.")
+    parser.add_argument(
+        "--seed", type=int,
+        help="Seed for the quiz. Running it again with the same seed and "
+             "answers, from the same history, asks the same questions.")
+    parser.add_argument(
+        "--replay", type=int, metavar="QUIZ",
+        help="Ask the questions of an earlier quiz again, without storing "
+             "the answers. Quizes are numbered from 0, or from -1 for the "
+             "latest.")
+    parser.set_defaults(func="mathquiz.quizrunner.run")
+    add_question_args(parser, load_question_index())
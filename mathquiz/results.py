@@ -1,16 +1,145 @@
+import time
+
+from mathquiz.questions import (
+    QuestionNotReproducible,
+    get_question_type,
+    )
+
+
+# Version of the compact record format written by to_record.
+RECORD_VERSION = 2
+
+# Keys of a record holding what's needed to recreate its question.
+GENERATION_KEYS = ('p', 's', 'tv', 'o', 'd')
+
+
+def generation_record(question):
+    """Return what's needed to recreate a question.
+
+    That's the seed, generator version, options and difficulty it was
+    generated from when it's reproducible, which takes a few bytes, and
+    all of its properties otherwise.
+    """
+    if not question.is_reproducible():
+        return {'p': question.properties()}
+
+    record = {'s': question.seed, 'tv': question.version}
+    options = question.resolved_options()
+    if options:
+        record['o'] = options
+    if question.target_difficulty:
+        record['d'] = question.target_difficulty
+    return record
+
+
+def question_from_generation_record(question_name, record):
+    try:
+        question_type = get_question_type(question_name)
+    except KeyError:
+        raise QuestionNotReproducible(
+            "Unknown question type: %s" % question_name)
+    if 'p' in record:
+        return question_type(properties=record['p'])
+    return question_type.from_seed(
+        record['s'], record['tv'], record.get('o'), record.get('d'))
+
+
+def question_to_record(question):
+    record = {
+        'v': RECORD_VERSION,
+        't': question.name,
+    }
+    record.update(generation_record(question))
+    record['uuid'] = question.uuid
+    return record
+
+
+def question_from_record(record):
+    if record['v'] > RECORD_VERSION:
+        raise ValueError(
+            "Unsupported question record version: %s" % record['v'])
+
+    question = question_from_generation_record(record['t'], record)
+    if 'uuid' in record:
+        question.uuid = record['uuid']
+    return question
+
+
 class QuestionResult(object):
-    def __init__(self, question, answer, result):
-        self.question = question
+    def __init__(self, question, answer, result, timestamp=None):
+        self._question = question
+        self._generation = None
+        self.question_name = question.name
         self.answer = answer
         self.result = result
+        if timestamp is None:
+            self.timestamp = time.time()
+        else:
+            self.timestamp = timestamp
+
+    def __setstate__(self, state):
+        # Results stored before compact records hold the whole question.
+        if 'question' in state:
+            state['_question'] = state.pop('question')
+            state['_generation'] = None
+            state['question_name'] = state['_question'].name
+            state['timestamp'] = None
+        self.__dict__.update(state)
+
+    @property
+    def question(self):
+        """The question, reconstructed from its record on first use.
+
+        None when its generator has changed or its type is gone, so it
+        can't be."""
+        if self._question is None:
+            try:
+                self._question = question_from_generation_record(
+                    self.question_name, self._generation)
+            except QuestionNotReproducible:
+                return None
+        return self._question
+
+    @classmethod
+    def from_record(cls, record):
+        question_result = cls.__new__(cls)
+        question_result._question = None
+        question_result._generation = dict(
+            (key, record[key]) for key in GENERATION_KEYS if key in record)
+        question_result.question_name = record['t']
+        question_result.answer = record['a']
+        question_result.result = record['r']
+        question_result.timestamp = record['ts']
+        return question_result
+
+    def to_record(self):
+        record = {
+            't': self.question_name,
+            'a': self.answer,
+            'r': self.result,
+            'ts': self.timestamp,
+        }
+        if self._question is None:
+            record.update(self._generation)
+        else:
+            record.update(generation_record(self._question))
+        return record
 
 
 class QuizResult(object):
-    def __init__(self, results=None):
+    def __init__(self, results=None, timestamp=None):
         if results is None:
             self.results = []
         else:
             self.results = results
+        if timestamp is None:
+            self.timestamp = time.time()
+        else:
+            self.timestamp = timestamp
+
+    def __setstate__(self, state):
+        state.setdefault('timestamp', None)
+        self.__dict__.update(state)
 
     @property
     def num_questions(self):
@@ -20,4 +149,24 @@ class QuizResult(object):
     def num_correct(self):
         return sum([result.result for result in self.results])
 
+    @classmethod
+    def from_record(cls, record):
+        if record['v'] > RECORD_VERSION:
+            raise ValueError(
+                "Unsupported result record version: %s" % record['v'])
+
+        quiz_result = cls(
+            [QuestionResult.from_record(question_record)
+             for question_record in record['results']])
+        # Old results have no timestamp, which must stay that way.
+        quiz_result.timestamp = record['ts']
+        return quiz_result
 
+    def to_record(self):
+        return {
+            'v': RECORD_VERSION,
+            'ts': self.timestamp,
+            'results': [
+                question_result.to_record()
+                for question_result in self.results],
+        }
@@ -0,0 +1,90 @@
+import math
+import random
+
+
+class WeightedScheduler(object):
+    """Picks items at random in proportion to real-valued weights.
+
+    Items are kept in groups by the power of two just above their
+    weight. Sampling picks a group in proportion to its total weight and
+    then an item from the group by rejection, which accepts at least
+    half of the time. With weights within a bounded range there are only
+    a handful of groups, so both sampling and changing a weight take
+    constant expected time.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = {}
+        self.groups = {}
+        self.group_totals = {}
+        self.positions = {}
+        if weights is not None:
+            for item, weight in weights.iteritems():
+                self.set_weight(item, weight)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __contains__(self, item):
+        return item in self.weights
+
+    @property
+    def total_weight(self):
+        return sum(self.group_totals.itervalues())
+
+    def get_weight(self, item):
+        return self.weights.get(item, 0)
+
+    def set_weight(self, item, weight):
+        if weight < 0:
+            raise ValueError("negative weights not supported.")
+
+        self.remove(item)
+        if weight == 0:
+            return
+
+        _, group_key = math.frexp(weight)
+        if group_key not in self.groups:
+            self.groups[group_key] = []
+            self.group_totals[group_key] = 0.0
+
+        group = self.groups[group_key]
+        self.positions[item] = (group_key, len(group))
+        group.append(item)
+        self.group_totals[group_key] += weight
+        self.weights[item] = weight
+
+    def remove(self, item):
+        if item not in self.weights:
+            return
+
+        group_key, index = self.positions.pop(item)
+        group = self.groups[group_key]
+        last_item = group.pop()
+        if last_item is not item:
+            group[index] = last_item
+            self.positions[last_item] = (group_key, index)
+
+        if group:
+            self.group_totals[group_key] -= self.weights[item]
+        else:
+            del self.groups[group_key]
+            del self.group_totals[group_key]
+        del self.weights[item]
+
+    def sample(self, rng=random):
+        if not self.weights:
+            raise IndexError("sample from an empty scheduler")
+
+        target = rng.random() * self.total_weight
+        for group_key, group_total in self.group_totals.iteritems():
+            target -= group_total
+            if target < 0:
+                break
+
+        group = self.groups[group_key]
+        group_limit = 2.0 ** group_key
+        while True:
+            item = group[int(rng.random() * len(group))]
+            if rng.random() * group_limit < self.weights[item]:
+                return item
@@ -0,0 +1,153 @@
+import yaml
+
+from fractions import Fraction
+
+from mathquiz.questions import (
+    Question,
+    QuestionNotReproducible,
+    builtin_question_types,
+    )
+from mathquiz.results import (
+    QuestionResult,
+    QuizResult,
+    question_from_record,
+    question_to_record,
+    )
+
+try:
+    from yaml import (
+        CSafeDumper as BaseDumper,
+        CSafeLoader as BaseLoader,
+        )
+except ImportError:
+    from yaml import (
+        SafeDumper as BaseDumper,
+        SafeLoader as BaseLoader,
+        )
+
+
+LEGACY_TAG_PREFIX = "tag:yaml.org,2002:python/object:"
+
+
+class Loader(BaseLoader):
+    """Safe loader that only builds mathquiz's own types."""
+
+
+class Dumper(BaseDumper):
+    """Safe dumper with representers for mathquiz's own types."""
+
+
+class LineDumper(yaml.SafeDumper):
+    """Dumper that never lets a scalar span more than one line.
+
+    libyaml doesn't let us pick scalar styles, so this is always the
+    pure Python dumper.
+    """
+
+    def choose_scalar_style(self):
+        if self.analysis is None:
+            self.analysis = self.analyze_scalar(self.event.value)
+        if self.analysis.multiline:
+            return '"'
+        return super(LineDumper, self).choose_scalar_style()
+
+
+def represent_quiz_result(dumper, quiz_result):
+    return dumper.represent_mapping('!quiz_result', quiz_result.to_record())
+
+
+def represent_question_result(dumper, question_result):
+    return dumper.represent_mapping(
+        '!question_result', question_result.to_record())
+
+
+def represent_question(dumper, question):
+    return dumper.represent_mapping('!question', question_to_record(question))
+
+
+def represent_fraction(dumper, fraction):
+    return dumper.represent_scalar('!fraction', str(fraction))
+
+
+def construct_quiz_result(loader, node):
+    return QuizResult.from_record(loader.construct_mapping(node, deep=True))
+
+
+def construct_question_result(loader, node):
+    return QuestionResult.from_record(
+        loader.construct_mapping(node, deep=True))
+
+
+def construct_question(loader, node):
+    # A question that can't be regenerated any more loads as None, so
+    # it doesn't stop the rest of the document from loading.
+    try:
+        return question_from_record(
+            loader.construct_mapping(node, deep=True))
+    except QuestionNotReproducible:
+        return None
+
+
+def construct_fraction(loader, node):
+    return Fraction(loader.construct_scalar(node))
+
+
+def legacy_object_constructor(cls):
+    """Build a constructor for objects dumped with yaml's python tags."""
+
+    def construct_legacy_object(loader, node):
+        instance = cls.__new__(cls)
+        yield instance
+        state = loader.construct_mapping(node, deep=True)
+        if hasattr(instance, '__setstate__'):
+            instance.__setstate__(state)
+        else:
+            instance.__dict__.update(state)
+
+    return construct_legacy_object
+
+
+def construct_legacy_fraction(loader, node):
+    return Fraction(*loader.construct_sequence(node))
+
+
+def construct_legacy_unicode(loader, node):
+    return unicode(loader.construct_scalar(node))
+
+
+for dumper_class in (Dumper, LineDumper):
+    dumper_class.add_representer(QuizResult, represent_quiz_result)
+    dumper_class.add_representer(QuestionResult, represent_question_result)
+    dumper_class.add_representer(Fraction, represent_fraction)
+    # Covers question types from plugins too.
+    dumper_class.add_multi_representer(Question, represent_question)
+
+Loader.add_constructor('!quiz_result', construct_quiz_result)
+Loader.add_constructor('!question_result', construct_question_result)
+Loader.add_constructor('!question', construct_question)
+Loader.add_constructor('!fraction', construct_fraction)
+
+for legacy_class in [QuizResult, QuestionResult] + builtin_question_types:
+    Loader.add_constructor(
+        "%s%s.%s" % (
+            LEGACY_TAG_PREFIX, legacy_class.__module__, legacy_class.__name__),
+        legacy_object_constructor(legacy_class))
+Loader.add_constructor(
+    "tag:yaml.org,2002:python/object/apply:fractions.Fraction",
+    construct_legacy_fraction)
+Loader.add_constructor(
+    "tag:yaml.org,2002:python/unicode", construct_legacy_unicode)
+
+
+def load(stream):
+    return yaml.load(stream, Loader=Loader)
+
+
+def dump(data, **kwargs):
+    return yaml.dump(data, Dumper=Dumper, **kwargs)
+
+
+def dump_line(data):
+    """Dump data as a single line of flow style YAML."""
+    return yaml.dump(
+        data, Dumper=LineDumper, default_flow_style=True, width=float('inf'))
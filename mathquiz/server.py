@@ -0,0 +1,235 @@
+import json
+import re
+import threading
+import time
+import traceback
+
+from BaseHTTPServer import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+    )
+from SocketServer import ThreadingMixIn
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from mathquiz.instrument import (
+    span,
+    summarize_timings,
+    )
+from mathquiz.quiz import get_next_question_by_history
+from mathquiz.stats import generate_stats
+from mathquiz.storage import (
+    add_answered_question,
+    get_unanswered_question,
+    remove_unanswered_question,
+    )
+
+
+DEFAULT_PORT = 8080
+
+# Number of threads doing blocking storage work.
+STORAGE_WORKERS = 4
+
+# Number of recent requests per endpoint used for latency percentiles.
+LATENCY_WINDOW = 1000
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+class LatencyTracker(object):
+    """Request counts and recent latencies for each endpoint."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.latencies = {}
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            if endpoint not in self.counts:
+                self.counts[endpoint] = 0
+                self.latencies[endpoint] = deque(maxlen=self.window)
+            self.counts[endpoint] += 1
+            self.latencies[endpoint].append(seconds)
+
+    def summary(self):
+        with self.lock:
+            summary = {}
+            for endpoint, latencies in self.latencies.iteritems():
+                summary[endpoint] = summarize_timings(latencies)
+                summary[endpoint]['count'] = self.counts[endpoint]
+            return summary
+
+
+def question_to_json(question):
+    return {
+        'uuid': question.uuid,
+        'type': question.name,
+        'explanation': question.explain(),
+        'question': question.question_string(),
+        'graphic_cue': question.graphic_cue,
+    }
+
+
+def stats_to_json(stats):
+    stats = dict(stats)
+    stats['question_types'] = {
+        question_type.name: history
+        for question_type, history in stats['question_types'].iteritems()}
+    return stats
+
+
+def next_question(user):
+    return question_to_json(get_next_question_by_history(user))
+
+
+def submit_answer(user, body):
+    if 'uuid' not in body or 'answer' not in body:
+        raise HTTPError(400, "uuid and answer are required")
+
+    question = get_unanswered_question(user, body['uuid'])
+    if question is None:
+        raise HTTPError(404, "No such question: %s" % body['uuid'])
+
+    # Only the request that removes the question records an answer, so
+    # it can't be answered twice by concurrent requests.
+    if not remove_unanswered_question(user, question.uuid):
+        raise HTTPError(404, "No such question: %s" % body['uuid'])
+
+    with span('question.check_answer'):
+        correct = question.check_answer(body['answer'])
+    add_answered_question(user, question, body['answer'], correct)
+    return {'correct': correct, 'answer': str(question.answer)}
+
+
+def user_stats(user):
+    return stats_to_json(generate_stats(user))
+
+
+# (method, path pattern, endpoint name, handler)
+routes = [
+    ('GET', re.compile(r'^/users/([^/]+)/question$'), 'question',
+     lambda user, body: next_question(user)),
+    ('POST', re.compile(r'^/users/([^/]+)/answer$'), 'answer',
+     submit_answer),
+    ('GET', re.compile(r'^/users/([^/]+)/stats$'), 'stats',
+     lambda user, body: user_stats(user)),
+]
+
+
+class QuizRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.handle_api_request('GET')
+
+    def do_POST(self):
+        self.handle_api_request('POST')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def read_body(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        if length == 0:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise HTTPError(400, "Request body must be JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return body
+
+    def handle_api_request(self, method):
+        start = time.time()
+        endpoint = 'unknown'
+        try:
+            if method == 'GET' and self.path == '/metrics':
+                endpoint = 'metrics'
+                self.send_json(200, self.server.latency.summary())
+                return
+
+            for route_method, pattern, route_endpoint, handler in routes:
+                match = pattern.match(self.path)
+                if match is None or route_method != method:
+                    continue
+                endpoint = route_endpoint
+                body = self.read_body()
+                response = self.server.storage_pool.apply(
+                    handler, (match.group(1), body))
+                self.send_json(200, response)
+                return
+
+            raise HTTPError(404, "Not found: %s %s" % (method, self.path))
+        except HTTPError as error:
+            self.send_json(error.status, {'error': str(error)})
+        except Exception:
+            # Answer anyway, so the client isn't left without a response.
+            traceback.print_exc()
+            self.send_json(500, {'error': "Internal server error"})
+        finally:
+            self.server.latency.record(endpoint, time.time() - start)
+
+    def send_json(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class QuizServer(ThreadingMixIn, HTTPServer):
+    """JSON quiz API serving any number of users from one process.
+
+    Each connection gets a thread, and storage work is run on a
+    bounded pool of threads so a burst of requests can't pile up on
+    the disk.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, storage_workers=STORAGE_WORKERS,
+                 verbose=False):
+        HTTPServer.__init__(self, address, QuizRequestHandler)
+        self.storage_pool = ThreadPool(storage_workers)
+        self.latency = LatencyTracker()
+        self.verbose = verbose
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.storage_pool.close()
+        self.storage_pool.join()
+
+
+def serve(args):
+    server = QuizServer(
+        (args.host, args.port), args.storage_workers, args.verbose)
+    print("Serving on http://%s:%d/" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.latency.summary(), indent=2, sort_keys=True))
+
+
+def setup_parser(parser):
+    parser.help = "Serve quizes over HTTP."
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument(
+        "-p", "--port", default=DEFAULT_PORT, type=int,
+        help="Port to listen on.")
+    parser.add_argument(
+        "--storage-workers", default=STORAGE_WORKERS, type=int,
+        help="Number of threads doing storage work.")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Log every request.")
+    parser.set_defaults(func=serve)
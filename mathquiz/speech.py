@@ -0,0 +1,237 @@
+import Queue
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+
+from distutils.spawn import find_executable
+
+from mathquiz.instrument import span
+from mathquiz.storage import get_local_storage_dir
+
+
+SPEECH_CACHE_PATH = "speech"
+
+# Evict the least recently used audio once the cache grows past this.
+SPEECH_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+
+class NullBackend(object):
+    """Backend used when no synthesizer is available."""
+
+    def speak(self, text):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeBackend(object):
+    """Backend that remembers what it was asked to say."""
+
+    def __init__(self):
+        self.spoken = []
+
+    def speak(self, text):
+        self.spoken.append(text)
+
+    def close(self):
+        pass
+
+
+class EspeakBackend(object):
+    """Speaks through one long-lived espeak process.
+
+    espeak reads text from stdin a line at a time and speaks each line as
+    it arrives, so there's no process start-up cost per utterance.
+    """
+
+    def __init__(self, command=('espeak',)):
+        self.process = subprocess.Popen(
+            list(command), stdin=subprocess.PIPE)
+
+    def speak(self, text):
+        self.process.stdin.write("%s\n" % " ".join(text.split()))
+        self.process.stdin.flush()
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class SpeechCache(object):
+    """WAV files of synthesized phrases, keyed by text and voice settings.
+
+    Files are touched whenever they're used and the least recently used
+    ones are removed once the cache is larger than max_bytes.
+    """
+
+    def __init__(self, path=None, voice_args=(),
+                 max_bytes=SPEECH_CACHE_MAX_BYTES):
+        if path is None:
+            path = os.path.join(get_local_storage_dir(), SPEECH_CACHE_PATH)
+        self.path = path
+        self.voice_args = list(voice_args)
+        self.max_bytes = max_bytes
+
+    def get_audio_path(self, text):
+        key = hashlib.sha1(
+            "%s\0%s" % (" ".join(self.voice_args), text)).hexdigest()
+        return os.path.join(self.path, "%s.wav" % key)
+
+    def get(self, text):
+        """Return the path of the audio for text, synthesizing it if needed.
+        """
+        audio_path = self.get_audio_path(text)
+        if os.path.exists(audio_path):
+            os.utime(audio_path, None)
+            return audio_path
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+        os.close(fd)
+        try:
+            with span('speech.synthesize'):
+                subprocess.check_call(
+                    ['espeak', '-w', tmp_path] + self.voice_args + [text])
+        except (subprocess.CalledProcessError, OSError):
+            os.remove(tmp_path)
+            raise
+        os.rename(tmp_path, audio_path)
+        self.evict(keep=audio_path)
+        return audio_path
+
+    def evict(self, keep=None):
+        entries = []
+        total_bytes = 0
+        for file_name in os.listdir(self.path):
+            if not file_name.endswith(".wav"):
+                continue
+            file_path = os.path.join(self.path, file_name)
+            stat = os.stat(file_path)
+            total_bytes += stat.st_size
+            if file_path != keep:
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+
+        for _, size, file_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                return
+            os.remove(file_path)
+            total_bytes -= size
+
+    def prewarm(self, phrases):
+        """Synthesize phrases on a background thread."""
+        def warm():
+            for text in phrases:
+                try:
+                    self.get(text)
+                except (subprocess.CalledProcessError, OSError):
+                    return
+
+        thread = threading.Thread(target=warm)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class CachedEspeakBackend(object):
+    """Plays the phrases given to prewarm from a SpeechCache, synthesizing
+    each only once.
+
+    Anything else is said once at most, so it's spoken by a long-lived
+    EspeakBackend instead of pushing the fixed phrases out of the cache.
+    """
+
+    def __init__(self, cache=None, player=('aplay', '-q')):
+        if cache is None:
+            cache = SpeechCache()
+        self.cache = cache
+        self.player = list(player)
+        self.cached_phrases = set()
+        self.espeak = None
+
+    def speak(self, text):
+        text = " ".join(text.split())
+        if text not in self.cached_phrases:
+            if self.espeak is None:
+                self.espeak = EspeakBackend(['espeak'] + self.cache.voice_args)
+            self.espeak.speak(text)
+            return
+
+        audio_path = self.cache.get(text)
+        subprocess.check_call(self.player + [audio_path])
+
+    def prewarm(self, phrases):
+        phrases = [" ".join(text.split()) for text in phrases]
+        self.cached_phrases.update(phrases)
+        return self.cache.prewarm(phrases)
+
+    def close(self):
+        if self.espeak is not None:
+            self.espeak.close()
+
+
+def get_speech_backend():
+    if find_executable('espeak') is None:
+        return NullBackend()
+
+    if find_executable('aplay') is not None:
+        return CachedEspeakBackend()
+
+    return EspeakBackend()
+
+
+class SpeechWorker(object):
+    """Speaks text on a background thread so callers don't wait for it.
+
+    Text that is still waiting to be spoken is dropped when newer text
+    is queued with interrupt=True, so feedback never lags behind the
+    quiz. If the backend fails the worker falls back to silence.
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = get_speech_backend()
+        self.backend = backend
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            text = self.queue.get()
+            if text is None:
+                return
+            try:
+                with span('speech.speak'):
+                    self.backend.speak(text)
+            except (IOError, OSError, subprocess.CalledProcessError):
+                self.backend = NullBackend()
+
+    def cancel_pending(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                return
+
+    def prewarm(self, phrases):
+        if hasattr(self.backend, 'prewarm'):
+            self.backend.prewarm(phrases)
+
+    def say(self, text, interrupt=True):
+        if interrupt:
+            self.cancel_pending()
+        self.queue.put(text)
+
+    def close(self):
+        """Finish speaking anything queued and shut down the backend."""
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            self.backend.close()
+        except (IOError, OSError):
+            pass
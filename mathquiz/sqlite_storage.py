@@ -0,0 +1,323 @@
+import os
+import sqlite3
+import threading
+import time
+
+from mathquiz import serialization
+from mathquiz.locking import get_file_lock
+from mathquiz.results import QuizResult
+from mathquiz.storage import (
+    Storage,
+    YamlStorage,
+    get_default_user_data,
+    get_local_storage_dir,
+    get_user_yaml_path,
+    init_local_storage,
+    )
+from mathquiz.unanswered import (
+    UNANSWERED_MAX_SIZE,
+    UNANSWERED_TTL,
+    )
+
+
+SQLITE_FILE_NAME = "mathquiz.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quizes (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    timestamp REAL
+);
+CREATE INDEX IF NOT EXISTS quizes_user ON quizes (user, id);
+
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    quiz_id INTEGER NOT NULL REFERENCES quizes (id),
+    user TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    result INTEGER NOT NULL,
+    timestamp REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_user ON results (user, id);
+CREATE INDEX IF NOT EXISTS results_quiz ON results (quiz_id, id);
+-- Made by earlier versions for queries nothing runs.
+DROP INDEX IF EXISTS results_user_type;
+DROP INDEX IF EXISTS results_user_timestamp;
+
+CREATE TABLE IF NOT EXISTS unanswered_questions (
+    uuid TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS unanswered_questions_user
+    ON unanswered_questions (user, timestamp);
+
+CREATE TABLE IF NOT EXISTS user_records (
+    user TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user, name)
+);
+"""
+
+
+# Tables whose timestamp used to be NOT NULL. Old results have none.
+NULLABLE_TIMESTAMP_TABLES = ['quizes', 'results']
+
+
+def get_sqlite_path():
+    return os.path.join(get_local_storage_dir(), SQLITE_FILE_NAME)
+
+
+def allow_null_timestamps(connection):
+    """Drop NOT NULL from the timestamps of databases made before
+    missing timestamps were stored as NULL.
+
+    SQLite can't change a column's constraints, so each table is copied
+    into a new one and renamed over it."""
+    script = []
+    for table in NULLABLE_TIMESTAMP_TABLES:
+        (sql,) = connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table,)).fetchone()
+        if "timestamp REAL NOT NULL" not in sql:
+            continue
+        sql = sql.replace("timestamp REAL NOT NULL", "timestamp REAL").replace(
+            "CREATE TABLE %s " % table, "CREATE TABLE %s_new " % table, 1)
+        script.extend([
+            "%s;" % sql,
+            "INSERT INTO %s_new SELECT * FROM %s;" % (table, table),
+            "DROP TABLE %s;" % table,
+            "ALTER TABLE %s_new RENAME TO %s;" % (table, table),
+        ])
+    if script:
+        # The indexes went with the old tables.
+        connection.executescript(
+            "BEGIN;\n%s\nCOMMIT;\n%s" % ("\n".join(script), SCHEMA))
+
+
+class SqliteStorage(Storage):
+    """Stores every user's data in one SQLite database.
+
+    Results are appended without rewriting anything, and unanswered
+    questions and per-user records are looked up by key. A user's YAML
+    file is imported the first time the user is accessed.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path
+        # sqlite3 connections can only be used by the thread that made them.
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.path is None:
+                init_local_storage(None)
+                self.path = get_sqlite_path()
+            connection = sqlite3.connect(self.path)
+            with self._schema_lock:
+                if not self._schema_ready:
+                    # Other processes may be creating the schema too.
+                    with get_file_lock("%s.lock" % self.path):
+                        connection.executescript(SCHEMA)
+                        allow_null_timestamps(connection)
+                    self._schema_ready = True
+            self._local.connection = connection
+        return connection
+
+    def load(self, user):
+        self.migrate(user)
+        return self._load(user)
+
+    def _load(self, user):
+        user_data = get_default_user_data()
+        quiz_results = {}
+        cursor = self.connection.execute(
+            "SELECT id, timestamp FROM quizes WHERE user = ? ORDER BY id",
+            (user,))
+        for quiz_id, timestamp in cursor:
+            quiz_results[quiz_id] = QuizResult()
+            quiz_results[quiz_id].timestamp = timestamp
+            user_data['results'].append(quiz_results[quiz_id])
+
+        cursor = self.connection.execute(
+            "SELECT quiz_id, data FROM results WHERE user = ? ORDER BY id",
+            (user,))
+        for quiz_id, data in cursor:
+            quiz_results[quiz_id].results.append(serialization.load(data))
+
+        cursor = self.connection.execute(
+            "SELECT data FROM unanswered_questions WHERE user = ?"
+            " ORDER BY timestamp", (user,))
+        for (data,) in cursor:
+            user_data['unanswered_questions'].append(
+                serialization.load(data))
+
+        return user_data
+
+    def iter_results(self, user):
+        self.migrate(user)
+        cursor = self.connection.execute(
+            "SELECT quizes.id, quizes.timestamp, results.data"
+            " FROM quizes LEFT JOIN results ON results.quiz_id = quizes.id"
+            " WHERE quizes.user = ? ORDER BY quizes.id, results.id",
+            (user,))
+        quiz_result = None
+        quiz_id = None
+        for row_quiz_id, timestamp, data in cursor:
+            if row_quiz_id != quiz_id:
+                if quiz_result is not None:
+                    yield quiz_result
+                quiz_id = row_quiz_id
+                quiz_result = QuizResult()
+                # Missing for old results.
+                quiz_result.timestamp = timestamp
+            if data is not None:
+                quiz_result.results.append(serialization.load(data))
+        if quiz_result is not None:
+            yield quiz_result
+
+    def migrate(self, user):
+        """Import the user's YAML file, if there is one.
+
+        Its results are older than any already in the database, so they
+        go first."""
+        user_yaml_path = get_user_yaml_path(user)
+        if not os.path.exists(user_yaml_path):
+            return
+
+        with self.lock(user):
+            if not os.path.exists(user_yaml_path):
+                # Another process migrated it first.
+                return
+
+            user_data = YamlStorage().load(user)
+            current_user_data = self._load(user)
+            for list_name in ('results', 'unanswered_questions'):
+                user_data[list_name].extend(current_user_data[list_name])
+            self.write(user, user_data)
+            # Indexes of the results that were already here are rebuilt
+            # from all of them.
+            with self.connection as connection:
+                connection.execute(
+                    "DELETE FROM user_records WHERE user = ?", (user,))
+            os.rename(user_yaml_path, "%s.migrated" % user_yaml_path)
+
+    def write(self, user, user_data):
+        with self.connection as connection:
+            connection.execute(
+                "DELETE FROM results WHERE user = ?", (user,))
+            connection.execute(
+                "DELETE FROM quizes WHERE user = ?", (user,))
+            connection.execute(
+                "DELETE FROM unanswered_questions WHERE user = ?", (user,))
+            for quiz_result in user_data['results']:
+                self._insert_quiz_result(connection, user, quiz_result)
+            for question in user_data['unanswered_questions']:
+                self._insert_unanswered(connection, user, question)
+
+    def _insert_quiz_result(self, connection, user, quiz_result):
+        cursor = connection.execute(
+            "INSERT INTO quizes (user, timestamp) VALUES (?, ?)",
+            (user, quiz_result.timestamp))
+        quiz_id = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO results"
+            " (quiz_id, user, question_type, result, timestamp, data)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(quiz_id, user, question_result.question_name,
+              question_result.result,
+              question_result.timestamp,
+              serialization.dump(question_result))
+             for question_result in quiz_result.results])
+
+    def _insert_unanswered(self, connection, user, question):
+        connection.execute(
+            "INSERT INTO unanswered_questions (uuid, user, timestamp, data)"
+            " VALUES (?, ?, ?, ?)",
+            (question.uuid, user, time.time(), serialization.dump(question)))
+
+    def append(self, user, list_name, item):
+        self.extend(user, list_name, [item])
+
+    def extend(self, user, list_name, items):
+        with self.connection as connection:
+            for item in items:
+                if list_name == 'results':
+                    self._insert_quiz_result(connection, user, item)
+                elif list_name == 'unanswered_questions':
+                    self._insert_unanswered(connection, user, item)
+                else:
+                    raise ValueError("Unknown list: %s" % list_name)
+
+    def remove_unanswered(self, user, question_uuid):
+        with self.connection as connection:
+            cursor = connection.execute(
+                "DELETE FROM unanswered_questions WHERE user = ? AND uuid = ?",
+                (user, question_uuid))
+            return cursor.rowcount > 0
+
+    def list_users(self):
+        cursor = self.connection.execute(
+            "SELECT user FROM quizes UNION SELECT user FROM user_records")
+        # Users whose YAML file hasn't been migrated yet count too.
+        users = set(YamlStorage().list_users())
+        users.update(user for (user,) in cursor)
+        return sorted(users)
+
+    def load_record(self, user, name):
+        self.migrate(user)
+        row = self.connection.execute(
+            "SELECT data FROM user_records WHERE user = ? AND name = ?",
+            (user, name)).fetchone()
+        if row is None:
+            return None
+        return serialization.load(row[0])
+
+    def write_record(self, user, name, record):
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO user_records (user, name, data)"
+                " VALUES (?, ?, ?)", (user, name, serialization.dump(record)))
+
+    def add_unanswered(self, user, question):
+        now = time.time()
+        with self.connection as connection:
+            connection.execute(
+                "DELETE FROM unanswered_questions"
+                " WHERE user = ? AND timestamp < ?",
+                (user, now - UNANSWERED_TTL))
+            connection.execute(
+                "INSERT OR REPLACE INTO unanswered_questions"
+                " (uuid, user, timestamp, data) VALUES (?, ?, ?, ?)",
+                (question.uuid, user, now, serialization.dump(question)))
+            connection.execute(
+                "DELETE FROM unanswered_questions WHERE uuid IN ("
+                " SELECT uuid FROM unanswered_questions WHERE user = ?"
+                " ORDER BY timestamp DESC LIMIT -1 OFFSET ?)",
+                (user, UNANSWERED_MAX_SIZE))
+
+    def get_unanswered(self, user, question_uuid=None):
+        expiry = time.time() - UNANSWERED_TTL
+        if question_uuid is None:
+            row = self.connection.execute(
+                "SELECT data FROM unanswered_questions"
+                " WHERE user = ? AND timestamp >= ?"
+                " ORDER BY timestamp LIMIT 1", (user, expiry)).fetchone()
+        else:
+            row = self.connection.execute(
+                "SELECT data FROM unanswered_questions"
+                " WHERE user = ? AND uuid = ? AND timestamp >= ?",
+                (user, question_uuid, expiry)).fetchone()
+
+        if row is None:
+            return None
+        return serialization.load(row[0])
@@ -1,67 +1,18 @@
-from collections import defaultdict
-from mathquiz.questions import builtin_question_types
-from mathquiz.storage import get_current_user_data
+import multiprocessing
 
-MASTERY_SIZE = 30
-MASTERY_PERCENT = 0.90
+from mathquiz.mastery import MASTERY_SIZE
+from mathquiz.registry import get_question_types
+from mathquiz.storage import (
+    configure_storage,
+    get_mastery_index,
+    get_stats_summary,
+    get_storage,
+    rebuild_user_indexes,
+    )
 
 
-def questions_from_user_data(user_data):
-    questions = []
-    for quiz in user_data['results']:
-        questions.extend(quiz.results)
-    return questions
-
-
-def question_type_mastered(question_type, question_type_history):
-    if len(question_type_history) < MASTERY_SIZE:
-        return False
-
-    relevant_history = question_type_history[-MASTERY_SIZE:]
-    correct_questions, _ = group_by_correctness(relevant_history)
-
-    return len(correct_questions)/float(MASTERY_SIZE) >= MASTERY_PERCENT
-
-
-def group_by_mastery(question_types, question_history):
-    """Partition a set of question types by mastery.
-
-    Mastery is defined as having answered at least 30 questions of the
-    type with at least 90% success rate over the last 30 questions.
-    """
-    mastered_question_types = set()
-    unmastered_question_types = set()
-    questions_by_type = group_by_type(question_history)
-    for question_type in question_types:
-        question_type_history = questions_by_type[question_type.name]
-        if question_type_mastered(question_type, question_type_history):
-            mastered_question_types.add(question_type)
-        else:
-            unmastered_question_types.add(question_type)
-
-    return {
-        'mastered': mastered_question_types,
-        'unmastered': unmastered_question_types,
-        }
-
-
-def group_by_type(question_results):
-    grouped = defaultdict(list)
-    for question_result in question_results:
-        grouped[question_result.question.name].append(question_result)
-    return grouped
-
-
-def group_by_correctness(question_results):
-    correct = []
-    incorrect = []
-    for question_result in question_results:
-        if question_result.result:
-            correct.append(question_result)
-        else:
-            incorrect.append(question_result)
-
-    return correct, incorrect
+# Number of users in the class leaderboard.
+LEADERBOARD_SIZE = 10
 
 
 def generate_stats(user):
@@ -71,49 +22,186 @@ def generate_stats(user):
         'question_types': {},
     }
 
-    user_data = get_current_user_data(user)
-    num_quizes = len(user_data['results'])
-    results['quizes']['completed'] = num_quizes
-
-    questions = questions_from_user_data(user_data)
+    summary = get_stats_summary(user)
+    results['quizes']['completed'] = summary.quizes
 
-    results['questions']['total'] = len(questions)
+    results['questions']['total'] = summary.questions
 
-    if len(questions) == 0:
+    if summary.questions == 0:
         results['questions']['correct'] = 0
         results['questions']['success_rate'] = 0
         return results
 
-    correct_questions, _ = group_by_correctness(questions)
-    results['questions']['correct'] = len(correct_questions)
+    results['questions']['correct'] = summary.correct
     results['questions']['success_rate'] = \
-        int(float(len(correct_questions))/len(questions) * 100)
-    by_mastery = group_by_mastery(builtin_question_types, questions)
+        int(float(summary.correct)/summary.questions * 100)
+    mastery_index = get_mastery_index(user)
+    question_types = get_question_types()
+    by_mastery = mastery_index.group_by_mastery(question_types)
 
-    for question_type in builtin_question_types:
+    for question_type in question_types:
         results['question_types'][question_type] = dict()
 
-    for mastery, question_types in by_mastery.iteritems():
-        for question_type in question_types:
+    for mastery, mastery_question_types in by_mastery.iteritems():
+        for question_type in mastery_question_types:
             results['question_types'][question_type]['mastery'] = mastery
 
     results['mastery_size'] = MASTERY_SIZE
 
-    for question_type in builtin_question_types:
-        questions_of_type = filter(
-            lambda x: x.question.name == question_type.name, questions)
-        relevant_questions = questions_of_type[-MASTERY_SIZE:]
+    for question_type in question_types:
         results['question_types'][question_type]['total'] = \
-            len(relevant_questions)
-        correct_of_type, _ = group_by_correctness(relevant_questions)
+            mastery_index.total(question_type.name)
         results['question_types'][question_type]['correct'] = \
-            len(correct_of_type)
+            mastery_index.correct(question_type.name)
+        counts = summary.question_type_counts(question_type.name)
+        results['question_types'][question_type]['all_time_total'] = \
+            counts['total']
+        results['question_types'][question_type]['all_time_correct'] = \
+            counts['correct']
+
+    return results
+
+
+def success_rate(correct, total):
+    if total == 0:
+        return 0
+    return int(float(correct) / total * 100)
 
+
+def init_stats_worker(storage_name):
+    configure_storage(storage_name)
+
+
+def generate_user_summary(user, rebuild=False):
+    """Return a user's stats with question types keyed by name, so they
+    can be sent between processes."""
+    if rebuild:
+        rebuild_user_indexes(user)
+    stats = generate_stats(user)
+    return {
+        'user': user,
+        'quizes': stats['quizes']['completed'],
+        'questions': stats['questions']['total'],
+        'correct': stats['questions']['correct'],
+        'question_types': dict(
+            (question_type.name, history)
+            for question_type, history in stats['question_types'].iteritems()),
+    }
+
+
+def generate_user_summary_star(args):
+    return generate_user_summary(*args)
+
+
+def iter_user_summaries(users, processes=None, rebuild=False):
+    """Yield the summary of each user, computed across a process pool."""
+    work = [(user, rebuild) for user in users]
+    if processes == 1 or len(work) <= 1:
+        for summary in map(generate_user_summary_star, work):
+            yield summary
+        return
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(
+        processes, init_stats_worker, (get_storage().name,))
+    try:
+        chunksize = max(1, len(work) // (4 * processes))
+        for summary in pool.imap_unordered(
+                generate_user_summary_star, work, chunksize):
+            yield summary
+    finally:
+        pool.close()
+        pool.join()
+
+
+def generate_class_stats(users, processes=None, rebuild=False):
+    results = {
+        'users': 0,
+        'quizes': 0,
+        'questions': 0,
+        'correct': 0,
+        'leaderboard': [],
+        'question_types': dict(
+            (question_type.name, {
+                'users': 0, 'mastered': 0, 'total': 0, 'correct': 0})
+            for question_type in get_question_types()),
+    }
+
+    for summary in iter_user_summaries(users, processes, rebuild):
+        results['users'] += 1
+        results['quizes'] += summary['quizes']
+        results['questions'] += summary['questions']
+        results['correct'] += summary['correct']
+
+        mastered = 0
+        for name, history in summary['question_types'].iteritems():
+            type_results = results['question_types'][name]
+            if history['all_time_total']:
+                type_results['users'] += 1
+            if history['mastery'] == 'mastered':
+                type_results['mastered'] += 1
+                mastered += 1
+            type_results['total'] += history['all_time_total']
+            type_results['correct'] += history['all_time_correct']
+
+        results['leaderboard'].append({
+            'user': summary['user'],
+            'questions': summary['questions'],
+            'correct': summary['correct'],
+            'success_rate': success_rate(
+                summary['correct'], summary['questions']),
+            'mastered': mastered,
+        })
+
+    results['leaderboard'].sort(
+        key=lambda entry: (-entry['correct'], -entry['success_rate'],
+                           entry['user']))
+    results['success_rate'] = success_rate(
+        results['correct'], results['questions'])
     return results
 
 
+def display_class_stats(args):
+    users = get_storage().list_users()
+    stats = generate_class_stats(users, args.processes, args.rebuild)
+    print("Stats for %d users:" % stats['users'])
+    print("Quizes completed: %d" % stats['quizes'])
+    print("Total questions: %d" % stats['questions'])
+    print("Correctly answered questions: %d" % stats['correct'])
+    print("Overall success rate: %d%%" % stats['success_rate'])
+
+    print("Leaderboard:")
+    for rank, entry in enumerate(stats['leaderboard'][:args.top], 1):
+        print("%d. %s: %d/%d (%d%%), %d types mastered" % (
+            rank,
+            entry['user'],
+            entry['correct'],
+            entry['questions'],
+            entry['success_rate'],
+            entry['mastered'],
+        ))
+
+    print("Per question type:")
+    for name, type_stats in sorted(stats['question_types'].iteritems()):
+        print("%s: mastered by %d/%d users, %d/%d (%d%%)" % (
+            name,
+            type_stats['mastered'],
+            stats['users'],
+            type_stats['correct'],
+            type_stats['total'],
+            success_rate(type_stats['correct'], type_stats['total']),
+        ))
+
+
 def display_stats(args):
+    if args.all_users:
+        display_class_stats(args)
+        return
+
     user = args.user
+    if args.rebuild:
+        rebuild_user_indexes(user)
     print("Stats for %s:" % user)
     stats = generate_stats(user)
     print("Quizes completed: %d" % stats['quizes']['completed'])
@@ -130,13 +218,27 @@ def display_stats(args):
         stats['mastery_size']))
 
     for question_type, history in stats['question_types'].iteritems():
-        print('%s: %s, %s/%s' % (
+        print('%s: %s, %s/%s (all time %s/%s)' % (
             question_type,
             history['mastery'],
             history['correct'],
             history['total'],
+            history['all_time_correct'],
+            history['all_time_total'],
         ))
 
 
 def setup_parser(parser):
+    parser.add_argument(
+        "--rebuild", action="store_true",
+        help="Recompute stats from the full history.")
+    parser.add_argument(
+        "-a", "--all-users", action="store_true",
+        help="Show stats for every user, with a leaderboard.")
+    parser.add_argument(
+        "-j", "--processes", type=int,
+        help="Processes to use with --all-users. By default, one per CPU.")
+    parser.add_argument(
+        "--top", type=int, default=LEADERBOARD_SIZE,
+        help="Number of users in the leaderboard.")
     parser.set_defaults(func=display_stats)
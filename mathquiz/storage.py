@@ -1,18 +1,46 @@
+import atexit
+import importlib
 import os
-import yaml
+import threading
 
+from mathquiz import serialization
+from mathquiz.config import (
+    DEFAULT_STORAGE_BACKEND,
+    get_local_storage_dir,
+    storage_backends,
+    )
+from mathquiz.difficulty import DifficultyRatings
+from mathquiz.instrument import timed
+from mathquiz.locking import (
+    atomic_write,
+    get_file_lock,
+    )
+from mathquiz.mastery import MasteryIndex
 from mathquiz.results import (
     QuestionResult,
     QuizResult,
     )
+from mathquiz.summary import StatsSummary
+from mathquiz.unanswered import UnansweredQuestions
 
 
-LOCAL_STORAGE_PATH = ".mathquiz"
+# Small per-user records derived from the results history. Each is
+# updated as results are stored and rebuilt from history when missing.
+user_indexes = [
+    MasteryIndex,
+    StatsSummary,
+    DifficultyRatings,
+]
 
+# Names of every per-user record, so record files can be told apart
+# from users' data files.
+user_record_names = [index_class.name for index_class in user_indexes] + [
+    UnansweredQuestions.name]
 
-def get_local_storage_dir():
-    home_path = os.getenv("HOME")
-    return os.path.join(home_path, LOCAL_STORAGE_PATH)
+_storage = None
+
+_results_logs = {}
+_results_logs_lock = threading.Lock()
 
 
 def init_local_storage(user):
@@ -21,7 +49,12 @@ def init_local_storage(user):
     if os.path.isdir(local_storage_dir):
         return
 
-    os.mkdir(local_storage_dir)
+    try:
+        os.mkdir(local_storage_dir)
+    except OSError:
+        # Another thread or process made it first.
+        if not os.path.isdir(local_storage_dir):
+            raise
 
 
 def get_user_yaml_path(user):
@@ -30,58 +63,323 @@ def get_user_yaml_path(user):
     return user_yaml
 
 
+def get_user_record_path(user, name):
+    local_storage_dir = get_local_storage_dir()
+    return os.path.join(local_storage_dir, "%s.%s.yaml" % (user, name))
+
+
+def get_user_lock_path(user):
+    local_storage_dir = get_local_storage_dir()
+    return os.path.join(local_storage_dir, "%s.lock" % user)
+
+
 def get_default_user_data():
     return dict(results=[], unanswered_questions=[])
 
 
+class Storage(object):
+    """Base class for storage backends.
+
+    Backends must implement load, write and append, plus
+    load_record and write_record for small named per-user records. The
+    query methods are answered from a full load unless a backend can do
+    better, and unanswered questions are kept in a record of their own.
+    """
+
+    # Whether append and remove are cheaper than rewriting everything.
+    incremental_writes = True
+
+    def lock(self, user):
+        """Return the lock serializing changes to a user's data.
+
+        Hold it around anything that reads data and writes back
+        something derived from it."""
+        init_local_storage(user)
+        return get_file_lock(get_user_lock_path(user))
+
+    def extend(self, user, list_name, items):
+        for item in items:
+            self.append(user, list_name, item)
+
+    def load_unanswered(self, user):
+        record = self.load_record(user, UnansweredQuestions.name)
+        if record is not None:
+            return UnansweredQuestions.from_record(record)
+        # Questions used to be kept with the rest of the user's data.
+        return UnansweredQuestions.from_user_data(self.load(user))
+
+    def add_unanswered(self, user, question):
+        with self.lock(user):
+            unanswered = self.load_unanswered(user)
+            unanswered.add(question)
+            self.write_record(
+                user, UnansweredQuestions.name, unanswered.to_record())
+
+    def get_unanswered(self, user, question_uuid=None):
+        return self.load_unanswered(user).get(question_uuid)
+
+    def remove_unanswered(self, user, question_uuid):
+        """Remove a question, returning whether it was there to remove."""
+        with self.lock(user):
+            unanswered = self.load_unanswered(user)
+            if not unanswered.remove(question_uuid):
+                return False
+            self.write_record(
+                user, UnansweredQuestions.name, unanswered.to_record())
+            return True
+
+    def iter_results(self, user):
+        """Yield a user's quiz results, oldest first."""
+        return iter(self.load(user)['results'])
+
+
+class YamlStorage(Storage):
+    """Stores all of a user's data in a single YAML document.
+
+    Every change rewrites the whole document, replacing it atomically so
+    readers don't need to take the lock.
+    """
+
+    name = "yaml"
+    incremental_writes = False
+
+    def load(self, user):
+        user_yaml_path = get_user_yaml_path(user)
+        if os.path.exists(user_yaml_path):
+            contents = open(user_yaml_path, "r").read()
+            return serialization.load(contents)
+        return get_default_user_data()
+
+    def write(self, user, user_data):
+        init_local_storage(user)
+        yaml_out = serialization.dump(user_data)
+
+        user_yaml_path = get_user_yaml_path(user)
+        atomic_write(user_yaml_path, [yaml_out])
+
+    def append(self, user, list_name, item):
+        self.extend(user, list_name, [item])
+
+    def extend(self, user, list_name, items):
+        with self.lock(user):
+            current_user_data = self.load(user)
+            current_user_data[list_name].extend(items)
+            self.write(user, current_user_data)
+
+    def list_users(self):
+        local_storage_dir = get_local_storage_dir()
+        if not os.path.isdir(local_storage_dir):
+            return []
+
+        record_suffixes = tuple(
+            ".%s.yaml" % name for name in user_record_names)
+        return sorted(
+            file_name[:-len(".yaml")]
+            for file_name in os.listdir(local_storage_dir)
+            if file_name.endswith(".yaml") and
+            not file_name.endswith(record_suffixes))
+
+    def load_record(self, user, name):
+        record_path = get_user_record_path(user, name)
+        if not os.path.exists(record_path):
+            return None
+        with open(record_path, "r") as record_file:
+            return serialization.load(record_file.read())
+
+    def write_record(self, user, name, record):
+        init_local_storage(user)
+        record_path = get_user_record_path(user, name)
+        atomic_write(record_path, [serialization.dump(record)])
+
+
+def get_storage_backend(name):
+    if name not in storage_backends:
+        raise ValueError("Unknown storage backend: %s" % name)
+
+    module_name, class_name = storage_backends[name].rsplit('.', 1)
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)()
+
+
+def configure_storage(name=None, cache=None):
+    """Select the storage backend, optionally behind an in-memory cache.
+
+    The cache is flushed when the program exits."""
+    global _storage
+    if name is None:
+        name = os.getenv("MATHQUIZ_STORAGE", DEFAULT_STORAGE_BACKEND)
+    if cache is None:
+        cache = bool(os.getenv("MATHQUIZ_CACHE"))
+    _storage = get_storage_backend(name)
+    if cache:
+        from mathquiz.cache import CachedStorage
+        _storage = CachedStorage(_storage)
+        atexit.register(_storage.close)
+    return _storage
+
+
+def get_storage():
+    if _storage is None:
+        return configure_storage()
+    return _storage
+
+
+@timed('storage.load')
 def get_current_user_data(user):
-    user_yaml_path = get_user_yaml_path(user)
-    if os.path.exists(user_yaml_path):
-        contents = open(user_yaml_path, "r").read()
-        return yaml.load(contents)
-    return get_default_user_data()
+    return get_storage().load(user)
 
 
+@timed('storage.write')
 def write_user_data(user, user_data):
-    yaml_out = yaml.dump(user_data)
-
-    user_yaml_path = get_user_yaml_path(user)
-
-    with open(user_yaml_path, "w") as user_yaml_file:
-        user_yaml_file.write(yaml_out)
+    get_storage().write(user, user_data)
 
 
+@timed('storage.append')
 def add_to_local_storage_list(user, list_name, item):
-    init_local_storage(user)
-    current_user_data = get_current_user_data(user)
-    current_user_data[list_name].append(item)
-    write_user_data(user, current_user_data)
-
-
+    get_storage().append(user, list_name, item)
+
+
+def rebuild_user_indexes(user):
+    storage = get_storage()
+    with storage.lock(user):
+        user_data = storage.load(user)
+        for index_class in user_indexes:
+            user_index = index_class.from_user_data(user_data)
+            storage.write_record(
+                user, index_class.name, user_index.to_record())
+
+
+@timed('storage.get_user_index')
+def get_user_index(user, index_class):
+    storage = get_storage()
+    record = storage.load_record(user, index_class.name)
+    if record is not None:
+        return index_class.from_record(record)
+
+    with storage.lock(user):
+        # Results stored while waiting for the lock already updated it.
+        record = storage.load_record(user, index_class.name)
+        if record is not None:
+            return index_class.from_record(record)
+        user_index = index_class.from_user_data(storage.load(user))
+        storage.write_record(user, index_class.name, user_index.to_record())
+    return user_index
+
+
+def get_mastery_index(user):
+    return get_user_index(user, MasteryIndex)
+
+
+def get_stats_summary(user):
+    return get_user_index(user, StatsSummary)
+
+
+def get_difficulty_ratings(user):
+    return get_user_index(user, DifficultyRatings)
+
+
+@timed('storage.update_user_indexes')
+def update_user_indexes(user, quiz_results):
+    storage = get_storage()
+    for index_class in user_indexes:
+        user_index = get_user_index(user, index_class)
+        for quiz_result in quiz_results:
+            user_index.record_quiz_result(quiz_result)
+        storage.write_record(user, index_class.name, user_index.to_record())
+
+
+class ResultsLog(object):
+    """Group commit for storing a user's quiz results.
+
+    Writers queue their results and commit. One writer at a time stores
+    every result queued so far, updating the indexes and appending them
+    in one go, while the others wait for it. Those whose results it took
+    are done when it finishes, and the next one stores everything queued
+    meanwhile, so concurrent writers share writes and syncs.
+
+    Results are stored with the user's lock held, so the indexes and
+    results stay in step when several processes record results for the
+    same user. Waiting writers don't hold it.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.condition = threading.Condition()
+        self.pending = []
+        self.queued = 0
+        self.committed = 0
+        self.committing = False
+
+    def add(self, quiz_result):
+        """Queue quiz_result and return its sequence number."""
+        with self.condition:
+            self.pending.append(quiz_result)
+            self.queued += 1
+            return self.queued
+
+    def commit(self, sequence):
+        """Return once the result with the given sequence number is
+        stored."""
+        with self.condition:
+            while self.committing:
+                self.condition.wait()
+                if self.committed >= sequence:
+                    return
+            if self.committed >= sequence:
+                return
+            self.committing = True
+
+        try:
+            storage = get_storage()
+            with storage.lock(self.user):
+                with self.condition:
+                    quiz_results = self.pending
+                    self.pending = []
+                    last_sequence = self.queued
+                try:
+                    update_user_indexes(self.user, quiz_results)
+                    storage.extend(self.user, 'results', quiz_results)
+                except Exception:
+                    # Left for the next writer to retry.
+                    with self.condition:
+                        self.pending[:0] = quiz_results
+                    raise
+            with self.condition:
+                self.committed = last_sequence
+        finally:
+            with self.condition:
+                self.committing = False
+                self.condition.notify_all()
+
+
+def get_results_log(user):
+    # Keyed by the lock's path, which follows the storage directory.
+    path = get_user_lock_path(user)
+    with _results_logs_lock:
+        if path not in _results_logs:
+            _results_logs[path] = ResultsLog(user)
+        return _results_logs[path]
+
+
+@timed('storage.store_quiz_results')
 def store_quiz_results_local(user, results):
-    add_to_local_storage_list(user, 'results', results)
+    results_log = get_results_log(user)
+    results_log.commit(results_log.add(results))
 
 
+@timed('storage.add_unanswered')
 def add_unanswered_question(user, question):
-    add_to_local_storage_list(user, 'unanswered_questions', question)
+    get_storage().add_unanswered(user, question)
 
 
+@timed('storage.get_unanswered')
 def get_unanswered_question(user, question_uuid=None):
-    user_data = get_current_user_data(user)
-    for question in user_data['unanswered_questions']:
-        if question_uuid is None or question.uuid == question_uuid:
-            return question
-
-    return None
+    return get_storage().get_unanswered(user, question_uuid)
 
 
+@timed('storage.remove_unanswered')
 def remove_unanswered_question(user, question_uuid):
-    user_data = get_current_user_data(user)
-    for index, question in enumerate(user_data['unanswered_questions']):
-        if question.uuid == question_uuid:
-            del user_data['unanswered_questions'][index]
-            write_user_data(user, user_data)
-            return
+    return get_storage().remove_unanswered(user, question_uuid)
 
 
 def add_answered_question(user, question, answer, correct):
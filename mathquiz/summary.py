@@ -0,0 +1,55 @@
+class StatsSummary(object):
+    """Running totals of a user's quizes and questions.
+
+    Updated as results are stored so stats don't have to walk the
+    user's history.
+    """
+
+    name = "summary"
+
+    def __init__(self, quizes=0, questions=0, correct=0,
+                 question_types=None):
+        self.quizes = quizes
+        self.questions = questions
+        self.correct = correct
+        if question_types is None:
+            self.question_types = {}
+        else:
+            self.question_types = question_types
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(**record)
+
+    def to_record(self):
+        return {
+            'quizes': self.quizes,
+            'questions': self.questions,
+            'correct': self.correct,
+            'question_types': self.question_types,
+        }
+
+    @classmethod
+    def from_user_data(cls, user_data):
+        summary = cls()
+        for quiz_result in user_data['results']:
+            summary.record_quiz_result(quiz_result)
+        return summary
+
+    def record(self, question_type_name, result):
+        self.questions += 1
+        self.correct += result
+        if question_type_name not in self.question_types:
+            self.question_types[question_type_name] = {
+                'total': 0, 'correct': 0}
+        self.question_types[question_type_name]['total'] += 1
+        self.question_types[question_type_name]['correct'] += result
+
+    def record_quiz_result(self, quiz_result):
+        self.quizes += 1
+        for question_result in quiz_result.results:
+            self.record(question_result.question_name, question_result.result)
+
+    def question_type_counts(self, question_type_name):
+        return self.question_types.get(
+            question_type_name, {'total': 0, 'correct': 0})
@@ -0,0 +1,278 @@
+import csv
+import itertools
+import json
+import sys
+
+from fractions import Fraction
+
+from mathquiz.results import (
+    QuestionResult,
+    QuizResult,
+    )
+from mathquiz.storage import (
+    get_storage,
+    get_user_index,
+    user_indexes,
+    )
+
+
+EXPORT_FORMATS = ['jsonl', 'csv']
+
+CSV_FIELDS = [
+    'user',
+    'quiz',
+    'quiz_timestamp',
+    'question_type',
+    'properties',
+    'generator',
+    'answer',
+    'result',
+    'timestamp',
+]
+
+# Quiz results written to storage at a time when importing.
+IMPORT_BATCH_SIZE = 500
+
+# Fields holding arbitrary values, which CSV stores JSON encoded.
+CSV_JSON_FIELDS = ['properties', 'generator', 'answer']
+
+# Keys of a result record that the generator field holds.
+GENERATOR_KEYS = ['s', 'tv', 'o', 'd']
+
+
+def encode_value(value):
+    if isinstance(value, Fraction):
+        return {'__fraction__': str(value)}
+    raise TypeError("Can't export %r" % value)
+
+
+def decode_value(obj):
+    if '__fraction__' in obj:
+        return Fraction(obj['__fraction__'])
+    return obj
+
+
+def to_json(value):
+    return json.dumps(value, default=encode_value, sort_keys=True)
+
+
+def from_json(text):
+    return json.loads(text, object_hook=decode_value)
+
+
+def iter_rows(user):
+    """Yield a row for each question result in a user's history."""
+    for quiz_number, quiz_result in enumerate(
+            get_storage().iter_results(user)):
+        for question_result in quiz_result.results:
+            record = question_result.to_record()
+            if 's' in record:
+                generator = dict(
+                    (key, record[key]) for key in GENERATOR_KEYS
+                    if key in record)
+            else:
+                generator = None
+            question = question_result.question
+            yield {
+                'user': user,
+                'quiz': quiz_number,
+                'quiz_timestamp': quiz_result.timestamp,
+                'question_type': record['t'],
+                # Regenerated for seeded questions, so the file can be
+                # read without mathquiz. Missing for questions whose
+                # generator has changed since.
+                'properties': (
+                    None if question is None else question.properties()),
+                'generator': generator,
+                'answer': record['a'],
+                'result': record['r'],
+                'timestamp': record['ts'],
+            }
+
+
+def write_jsonl(rows, out_file):
+    for row in rows:
+        out_file.write(to_json(row))
+        out_file.write("\n")
+
+
+def read_jsonl(in_file):
+    for line in in_file:
+        if line.strip():
+            yield from_json(line)
+
+
+def write_csv(rows, out_file):
+    writer = csv.DictWriter(out_file, CSV_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        row = dict(row)
+        for field in CSV_JSON_FIELDS:
+            row[field] = to_json(row[field])
+        writer.writerow(row)
+
+
+def read_csv(in_file):
+    for row in csv.DictReader(in_file):
+        for field in CSV_JSON_FIELDS:
+            # Older exports have no generator field.
+            if field in row:
+                row[field] = from_json(row[field])
+        row['quiz'] = int(row['quiz'])
+        row['result'] = int(row['result'])
+        for field in ('quiz_timestamp', 'timestamp'):
+            if row[field]:
+                row[field] = float(row[field])
+            else:
+                row[field] = None
+        yield row
+
+
+writers = {
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+}
+
+readers = {
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+
+def question_result_from_row(row):
+    record = {
+        't': row['question_type'],
+        'a': row['answer'],
+        'r': row['result'],
+        'ts': row['timestamp'],
+    }
+    if row.get('generator'):
+        record.update(row['generator'])
+    else:
+        record['p'] = row['properties']
+    return QuestionResult.from_record(record)
+
+
+def iter_quiz_results(rows):
+    """Group consecutive rows back into (user, quiz result) pairs."""
+    for (user, _), quiz_rows in itertools.groupby(
+            rows, lambda row: (row['user'], row['quiz'])):
+        quiz_rows = list(quiz_rows)
+        quiz_result = QuizResult(
+            [question_result_from_row(row) for row in quiz_rows])
+        # Keep missing timestamps of old results missing.
+        quiz_result.timestamp = quiz_rows[0]['quiz_timestamp']
+        yield user, quiz_result
+
+
+def import_user_results(user, quiz_results):
+    """Add quiz results to a user's history, returning how many.
+
+    The user's indexes are updated in memory and written once at the end.
+    """
+    storage = get_storage()
+    count = 0
+    with storage.lock(user):
+        indexes = [
+            get_user_index(user, index_class) for index_class in user_indexes]
+
+        if storage.incremental_writes:
+            batch = []
+            for quiz_result in quiz_results:
+                for user_index in indexes:
+                    user_index.record_quiz_result(quiz_result)
+                batch.append(quiz_result)
+                count += 1
+                if len(batch) == IMPORT_BATCH_SIZE:
+                    storage.extend(user, 'results', batch)
+                    batch = []
+            storage.extend(user, 'results', batch)
+        else:
+            user_data = storage.load(user)
+            for quiz_result in quiz_results:
+                for user_index in indexes:
+                    user_index.record_quiz_result(quiz_result)
+                user_data['results'].append(quiz_result)
+                count += 1
+            storage.write(user, user_data)
+
+        for user_index in indexes:
+            storage.write_record(user, user_index.name, user_index.to_record())
+    return count
+
+
+def import_rows(rows, user=None):
+    """Import rows into storage, into their own users unless user is given.
+
+    Returns the number of quiz results imported per user."""
+    counts = {}
+    # Grouped by the users in the file, so quizes of different users
+    # aren't merged when they're all imported for one.
+    for row_user, user_quiz_results in itertools.groupby(
+            iter_quiz_results(rows), lambda pair: pair[0]):
+        if user is not None:
+            row_user = user
+        count = import_user_results(
+            row_user, (quiz_result for _, quiz_result in user_quiz_results))
+        counts[row_user] = counts.get(row_user, 0) + count
+    return counts
+
+
+def get_format(args, file_name):
+    if args.format is not None:
+        return args.format
+    for file_format in EXPORT_FORMATS:
+        if file_name.endswith(".%s" % file_format):
+            return file_format
+    return 'jsonl'
+
+
+def export_results(args):
+    users = args.users or [args.user]
+    rows = itertools.chain.from_iterable(iter_rows(user) for user in users)
+    file_format = get_format(args, args.output)
+    if args.output == "-":
+        writers[file_format](rows, sys.stdout)
+    else:
+        with open(args.output, "wb") as out_file:
+            writers[file_format](rows, out_file)
+
+
+def import_results(args):
+    file_format = get_format(args, args.input)
+    if args.input == "-":
+        counts = import_rows(readers[file_format](sys.stdin), args.as_user)
+    else:
+        with open(args.input, "rb") as in_file:
+            counts = import_rows(readers[file_format](in_file), args.as_user)
+
+    for user, count in sorted(counts.iteritems()):
+        print("Imported %d quizes for %s" % (count, user))
+
+
+def setup_export_parser(parser):
+    parser.help = "Export quiz results as JSON lines or CSV."
+    parser.add_argument(
+        "users", nargs="*",
+        help="Users to export. By default, the current user.")
+    parser.add_argument(
+        "-o", "--output", default="-",
+        help="File to write to. By default, standard output.")
+    parser.add_argument(
+        "-f", "--format", choices=EXPORT_FORMATS,
+        help="Output format. By default, guessed from the file name.")
+    parser.set_defaults(func=export_results)
+
+
+def setup_import_parser(parser):
+    parser.help = "Import quiz results from JSON lines or CSV."
+    parser.add_argument(
+        "input", help="File to read, or - for standard input.")
+    parser.add_argument(
+        "-f", "--format", choices=EXPORT_FORMATS,
+        help="Input format. By default, guessed from the file name.")
+    parser.add_argument(
+        "--as-user",
+        help="Import every result for this user instead of the users "
+             "named in the file.")
+    parser.set_defaults(func=import_results)
@@ -0,0 +1,88 @@
+import time
+
+
+# Forget questions that haven't been answered after this many seconds...
+UNANSWERED_TTL = 24 * 60 * 60
+
+# ...and the oldest ones once a user has more than this many.
+UNANSWERED_MAX_SIZE = 100
+
+
+class UnansweredQuestions(object):
+    """A user's questions waiting for an answer, keyed by uuid.
+
+    Kept apart from the results history, so adding and answering a
+    question only rewrites this small record. Questions expire after
+    ttl seconds and the oldest are dropped beyond max_size, so
+    abandoned questions don't pile up.
+    """
+
+    name = "unanswered"
+
+    def __init__(self, questions=None, ttl=UNANSWERED_TTL,
+                 max_size=UNANSWERED_MAX_SIZE):
+        # uuid -> {'ts': time added, 'question': question}
+        if questions is None:
+            self.questions = {}
+        else:
+            self.questions = questions
+        self.ttl = ttl
+        self.max_size = max_size
+
+    @classmethod
+    def from_record(cls, record):
+        # Drop questions that couldn't be regenerated.
+        return cls(dict(
+            (question_uuid, entry)
+            for question_uuid, entry in record['questions'].iteritems()
+            if entry['question'] is not None))
+
+    def to_record(self):
+        return {'questions': self.questions}
+
+    @classmethod
+    def from_user_data(cls, user_data):
+        unanswered = cls()
+        for question in user_data['unanswered_questions']:
+            if question is not None:
+                unanswered.add(question)
+        return unanswered
+
+    def is_expired(self, entry, now):
+        return now - entry['ts'] > self.ttl
+
+    def add(self, question, now=None):
+        if now is None:
+            now = time.time()
+        self.expire(now)
+        self.questions[question.uuid] = {'ts': now, 'question': question}
+        while len(self.questions) > self.max_size:
+            oldest = min(
+                self.questions, key=lambda uuid: self.questions[uuid]['ts'])
+            del self.questions[oldest]
+
+    def get(self, question_uuid=None, now=None):
+        """Return the question with the given uuid, or the oldest one."""
+        if now is None:
+            now = time.time()
+        if question_uuid is None:
+            entries = sorted(
+                self.questions.itervalues(), key=lambda entry: entry['ts'])
+        else:
+            entries = [self.questions.get(question_uuid)]
+
+        for entry in entries:
+            if entry is not None and not self.is_expired(entry, now):
+                return entry['question']
+        return None
+
+    def remove(self, question_uuid):
+        """Remove a question, returning whether it was there."""
+        return self.questions.pop(question_uuid, None) is not None
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.time()
+        for question_uuid, entry in self.questions.items():
+            if self.is_expired(entry, now):
+                del self.questions[question_uuid]
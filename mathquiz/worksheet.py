@@ -0,0 +1,342 @@
+import csv
+import json
+import multiprocessing
+import random
+import sys
+
+from StringIO import StringIO
+from argparse import Namespace
+from mathquiz.difficulty import DifficultyRatings
+from mathquiz.mastery import MasteryIndex
+from mathquiz.questions import new_seed
+from mathquiz.quiz import Quiz
+from mathquiz.registry import (
+    add_question_args,
+    get_question_types,
+    load_question_index,
+    )
+from mathquiz.results import generation_record
+from mathquiz.storage import (
+    configure_storage,
+    get_difficulty_ratings,
+    get_mastery_index,
+    get_storage,
+    )
+
+
+WORKSHEET_FORMATS = ['text', 'jsonl', 'csv']
+
+WORKSHEET_SIZE = 20
+
+# Worksheets handed to the pool at a time, per process. Bounds how many
+# finished worksheets can wait in memory for the writer.
+WORKSHEETS_IN_FLIGHT = 8
+
+QUESTION_FIELDS = [
+    'worksheet',
+    'student',
+    'number',
+    'question_type',
+    'generator',
+    'explanation',
+    'question',
+    'graphic_cue',
+    'answer',
+]
+
+ANSWER_KEY_FIELDS = ['worksheet', 'number', 'answer']
+
+# Set in each worker by init_worksheet_worker.
+_settings = None
+
+
+def init_worksheet_worker(storage_name, settings):
+    global _settings
+    if storage_name is not None:
+        configure_storage(storage_name)
+    _settings = settings
+
+
+def get_question_options(args):
+    """Pull the question type options out of the parsed arguments, named
+    the way Quiz.generate_question looks them up."""
+    options = Namespace()
+    for question_type in get_question_types():
+        for option_name in question_type.options:
+            name = "%s_%s" % (question_type.name, option_name)
+            # argparse turns the dashes of option names into underscores.
+            setattr(options, name, getattr(args, name.replace('-', '_')))
+    return options
+
+
+def make_quiz(student, seed):
+    """A quiz weighted by the student's history, or evenly without one."""
+    question_types = get_question_types(_settings['include'])
+    if student is None:
+        return Quiz(question_types, MasteryIndex(), DifficultyRatings(), seed)
+    return Quiz(
+        question_types, get_mastery_index(student),
+        get_difficulty_ratings(student), seed)
+
+
+def worksheet_title(number, student):
+    if student is None:
+        return "Worksheet %d" % number
+    return "Worksheet %d for %s" % (number, student)
+
+
+def format_clock_cue(clock):
+    if clock['minutes'] == 0:
+        hour_hand = "points at %d" % clock['hours']
+    else:
+        hour_hand = "is between %d and %d" % (
+            clock['hours'], clock['hours'] % 12 + 1)
+    if clock['minutes'] % 5 == 0:
+        minute_hand = "points at %d" % (clock['minutes'] / 5 or 12)
+    else:
+        minute_hand = "is %d minutes past 12" % clock['minutes']
+    return "The clock's hour hand %s and its minute hand %s." % (
+        hour_hand, minute_hand)
+
+
+# Describe the graphic cues text worksheets can't draw. Cues that only
+# repeat the question, like a rectangle's sides, are left out.
+text_cue_formatters = {
+    'clock': format_clock_cue,
+}
+
+
+def format_text_cues(graphic_cue):
+    return [
+        text_cue_formatters[kind](cue)
+        for kind, cue in sorted(graphic_cue.iteritems())
+        if kind in text_cue_formatters]
+
+
+def format_text(number, student, questions, separate_key):
+    title = worksheet_title(number, student)
+    sheet = [title, ""]
+    key = ["Answers to %s" % title, ""]
+    for question_number, question in enumerate(questions, 1):
+        sheet.append("%d. %s" % (question_number, " ".join(
+            [question.explain()] +
+            format_text_cues(question.graphic_cue) +
+            [question.question_string().strip()])))
+        key.append("%d. %s" % (question_number, question.answer))
+
+    if separate_key:
+        return "\n".join(sheet) + "\n\f\n", "\n".join(key) + "\n\f\n"
+    return "\n".join(sheet + [""] + key) + "\n\f\n", ""
+
+
+def question_rows(number, student, questions):
+    for question_number, question in enumerate(questions, 1):
+        yield {
+            'worksheet': number,
+            'student': student,
+            'number': question_number,
+            'question_type': question.name,
+            # What the question can be regenerated from.
+            'generator': generation_record(question),
+            'explanation': question.explain(),
+            'question': question.question_string().strip(),
+            'graphic_cue': question.graphic_cue,
+            'answer': str(question.answer),
+        }
+
+
+def split_answers(rows, separate_key):
+    """Return the rows for the worksheet and for the answer key."""
+    rows = list(rows)
+    if not separate_key:
+        return rows, []
+    key_rows = [
+        dict((field, row[field]) for field in ANSWER_KEY_FIELDS)
+        for row in rows]
+    for row in rows:
+        del row['answer']
+    return rows, key_rows
+
+
+def format_jsonl(number, student, questions, separate_key):
+    rows, key_rows = split_answers(
+        question_rows(number, student, questions), separate_key)
+    # Without sort_keys, so the C encoder is used.
+    return (
+        "".join(json.dumps(row) + "\n" for row in rows),
+        "".join(json.dumps(row) + "\n" for row in key_rows))
+
+
+def write_csv_rows(fields, rows):
+    out = StringIO()
+    csv.DictWriter(out, fields).writerows(rows)
+    return out.getvalue()
+
+
+def format_csv(number, student, questions, separate_key):
+    rows, key_rows = split_answers(
+        question_rows(number, student, questions), separate_key)
+    for row in rows:
+        row['generator'] = json.dumps(row['generator'], sort_keys=True)
+        row['graphic_cue'] = json.dumps(row['graphic_cue'], sort_keys=True)
+    fields = QUESTION_FIELDS
+    if separate_key:
+        fields = [field for field in fields if field != 'answer']
+    return (
+        write_csv_rows(fields, rows),
+        write_csv_rows(ANSWER_KEY_FIELDS, key_rows))
+
+
+formatters = {
+    'text': format_text,
+    'jsonl': format_jsonl,
+    'csv': format_csv,
+}
+
+
+def csv_header(fields):
+    out = StringIO()
+    csv.DictWriter(out, fields).writeheader()
+    return out.getvalue()
+
+
+def generate_worksheet(task):
+    """Generate a worksheet, returning its text and its answer key."""
+    number, student, seed = task
+    quiz = make_quiz(student, seed)
+    questions = quiz.questions(
+        _settings['num_questions'], _settings['options'])
+    return formatters[_settings['format']](
+        number, student, questions, _settings['separate_key'])
+
+
+def iter_tasks(students, copies, seed):
+    """Yield the number, student and seed of each worksheet.
+
+    Seeds are drawn here, in order, so the same seed gives the same
+    worksheets however they're spread across processes."""
+    rng = random.Random(seed)
+    number = 1
+    for _ in xrange(copies):
+        for student in students:
+            yield number, student, new_seed(rng)
+            number += 1
+
+
+def iter_windows(items, size):
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def iter_worksheets(tasks, settings, processes=None, count=None):
+    """Yield each worksheet in order, generated across a process pool."""
+    if processes == 1 or count == 1:
+        init_worksheet_worker(None, settings)
+        for task in tasks:
+            yield generate_worksheet(task)
+        return
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(
+        processes, init_worksheet_worker, (get_storage().name, settings))
+    try:
+        for window in iter_windows(tasks, WORKSHEETS_IN_FLIGHT * processes):
+            for worksheet in pool.imap(generate_worksheet, window):
+                yield worksheet
+    finally:
+        pool.close()
+        pool.join()
+
+
+def open_output(file_name):
+    if file_name == "-":
+        return sys.stdout
+    return open(file_name, "wb")
+
+
+def generate_worksheets(args):
+    if args.all_users:
+        students = sorted(get_storage().list_users())
+    elif args.students:
+        students = args.students
+    else:
+        students = [None]
+
+    separate_key = args.answer_key is not None
+    settings = {
+        'num_questions': args.num_questions,
+        'include': args.include,
+        'options': get_question_options(args),
+        'format': args.format,
+        'separate_key': separate_key,
+    }
+    tasks = iter_tasks(students, args.copies, args.seed)
+
+    out_file = open_output(args.output)
+    key_file = open_output(args.answer_key) if separate_key else None
+    try:
+        if args.format == 'csv':
+            if separate_key:
+                out_file.write(csv_header(
+                    [field for field in QUESTION_FIELDS if field != 'answer']))
+                key_file.write(csv_header(ANSWER_KEY_FIELDS))
+            else:
+                out_file.write(csv_header(QUESTION_FIELDS))
+
+        for sheet, key in iter_worksheets(
+                tasks, settings, args.processes,
+                args.copies * len(students)):
+            out_file.write(sheet)
+            if key_file is not None:
+                key_file.write(key)
+    finally:
+        for open_file in (out_file, key_file):
+            if open_file not in (None, sys.stdout):
+                open_file.close()
+
+
+def setup_parser(parser):
+    parser.help = "Generate worksheets with answer keys."
+    parser.add_argument(
+        "-n", "--num_questions", type=int, default=WORKSHEET_SIZE,
+        help="Number of questions on each worksheet.")
+    parser.add_argument(
+        "-i", "--include", nargs="+",
+        help="questions to include. by default, all are included.")
+    parser.add_argument(
+        "--students", nargs="+",
+        help="Make worksheets for these users, picking questions by their "
+             "history like a quiz does. By default, worksheets are for "
+             "no one in particular.")
+    parser.add_argument(
+        "-a", "--all-users", action="store_true",
+        help="Make worksheets for every user.")
+    parser.add_argument(
+        "--copies", type=int, default=1,
+        help="Number of worksheets for each student.")
+    parser.add_argument(
+        "--seed", type=int,
+        help="Seed, so the same worksheets can be generated again.")
+    parser.add_argument(
+        "-f", "--format", choices=WORKSHEET_FORMATS, default='text',
+        help="Output format.")
+    parser.add_argument(
+        "-o", "--output", default="-",
+        help="File to write to. By default, standard output.")
+    parser.add_argument(
+        "--answer-key",
+        help="File to write the answers to. By default, they're written "
+             "with the questions.")
+    parser.add_argument(
+        "-j", "--processes", type=int,
+        help="Processes to generate worksheets with. By default, one per "
+             "CPU.")
+    parser.set_defaults(func=generate_worksheets)
+    add_question_args(parser, load_question_index())
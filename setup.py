@@ -5,4 +5,7 @@ from setuptools import setup, find_packages
 setup(
     name='mathquiz',
     packages=find_packages(),
+    extras_require={
+        'numpy': ['numpy'],
+    },
 )
@@ -0,0 +1,95 @@
+import os
+import threading
+import unittest
+
+from mathquiz.speech import (
+    CachedEspeakBackend,
+    FakeBackend,
+    NullBackend,
+    SpeechWorker,
+    )
+
+
+class BlockingBackend(FakeBackend):
+    """Holds up the worker in speak until released."""
+
+    def __init__(self):
+        super(BlockingBackend, self).__init__()
+        self.speaking = threading.Event()
+        self.released = threading.Event()
+
+    def speak(self, text):
+        super(BlockingBackend, self).speak(text)
+        self.speaking.set()
+        self.released.wait()
+
+
+class FailingBackend(FakeBackend):
+    def speak(self, text):
+        super(FailingBackend, self).speak(text)
+        raise OSError("no audio device")
+
+
+class FakeSpeechCache(object):
+    """Stands in for SpeechCache, remembering what it was asked for."""
+
+    voice_args = []
+
+    def __init__(self):
+        self.requested = []
+
+    def get(self, text):
+        self.requested.append(text)
+        return os.devnull
+
+    def prewarm(self, phrases):
+        pass
+
+
+class SpeechWorkerTest(unittest.TestCase):
+
+    def test_speaks_queued_text_in_order(self):
+        backend = FakeBackend()
+        worker = SpeechWorker(backend)
+        for text in ["one", "two", "three"]:
+            worker.say(text, interrupt=False)
+        worker.close()
+        self.assertEqual(backend.spoken, ["one", "two", "three"])
+
+    def test_interrupt_drops_text_not_yet_spoken(self):
+        backend = BlockingBackend()
+        worker = SpeechWorker(backend)
+        worker.say("one")
+        backend.speaking.wait()
+        worker.say("two", interrupt=False)
+        worker.say("three", interrupt=False)
+        worker.say("four")
+        backend.released.set()
+        worker.close()
+        self.assertEqual(backend.spoken, ["one", "four"])
+
+    def test_falls_back_to_silence_when_backend_fails(self):
+        backend = FailingBackend()
+        worker = SpeechWorker(backend)
+        worker.say("one", interrupt=False)
+        worker.say("two", interrupt=False)
+        worker.close()
+        self.assertEqual(backend.spoken, ["one"])
+        self.assertIsInstance(worker.backend, NullBackend)
+
+
+class CachedEspeakBackendTest(unittest.TestCase):
+
+    def test_caches_only_prewarmed_phrases(self):
+        cache = FakeSpeechCache()
+        backend = CachedEspeakBackend(cache, player=['true'])
+        backend.espeak = FakeBackend()
+        backend.prewarm(["Correct,  genius!"])
+        backend.speak("Correct, genius!")
+        backend.speak("Wrong, the answer was 4")
+        self.assertEqual(cache.requested, ["Correct, genius!"])
+        self.assertEqual(backend.espeak.spoken, ["Wrong, the answer was 4"])
+
+
+if __name__ == '__main__':
+    unittest.main()